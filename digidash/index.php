@@ -51,6 +51,7 @@ body { background:#121212; color:#fff; }
 .badge-dmr { background:#fd7e14; }
 .badge-p25 { background:#20c997; }
 .badge-ysf { background:#a855f7; }
+.badge-nxdn { background:#e83e8c; }
 .nowrap { white-space:nowrap; }
 
 .section-divider {
@@ -87,7 +88,7 @@ body { background:#121212; color:#fff; }
 
   <div class="nav-row2">
     <div class="navbar-text modules">
-      M17 / DMR / P25 / YSF — Live Status
+      M17 / DMR / P25 / YSF / NXDN — Live Status
     </div>
     <div class="navbar-text uptime" id="uptime">Service uptime: Loading…</div>
   </div>
@@ -156,6 +157,16 @@ body { background:#121212; color:#fff; }
 <tbody id="ysf-body"><tr><td colspan="5">Waiting for data…</td></tr></tbody>
 </table>
 
+<div id="nxdn-section" style="display:none">
+<h3>NXDN</h3>
+<table class="table table-dark table-striped">
+<thead>
+<tr><th>Time</th><th>Callsign</th><th>Destination</th><th>At</th></tr>
+</thead>
+<tbody id="nxdn-body"><tr><td colspan="4">Waiting for data…</td></tr></tbody>
+</table>
+</div>
+
 </div>
 
 <footer class="mt-4 text-white">
@@ -167,11 +178,99 @@ body { background:#121212; color:#fff; }
 </div>
 </footer>
 
+<script id="ws-worker" type="text/js-worker">
+// Runs in a Web Worker: owns the socket, parses frames and applies deltas,
+// and posts the page only the sections that changed.
+// Delta protocol: full snapshot on connect, then only changed rows.
+// Each delta carries seq; on a gap we ask the server for a resync.
+const SECTIONS = ['clients_talking','last_heard','peers'];
+const NOT_STATUS = ['type','seq','uptime_seconds','combined'];
+let ws, url, state = null, seq = null, attempt = 0;
+
+function requestResync(){
+  seq = null;
+  if(ws && ws.readyState === WebSocket.OPEN){
+    ws.send(JSON.stringify({type:'resync'}));
+  }
+}
+
+function applySectionDelta(rows, d){
+  const byKey = new Map(rows.map(r=>[r.key,r]));
+  (d.removed||[]).forEach(k=>byKey.delete(k));
+  (d.added||[]).forEach(r=>byKey.set(r.key,r));
+  (d.updated||[]).forEach(r=>byKey.set(r.key,r));
+  return (d.order||[...byKey.keys()]).map(k=>byKey.get(k)).filter(Boolean);
+}
+
+// Everything in a whole frame (snapshot, or a plain full frame from an older server)
+function wholeFrame(d){
+  state = d;
+  const changes = {combined:{}, status:{}};
+  SECTIONS.forEach(s=>{ if(d.combined && d.combined[s]) changes.combined[s] = d.combined[s]; });
+  Object.keys(d).forEach(k=>{ if(!NOT_STATUS.includes(k)) changes.status[k] = d[k]; });
+  return changes;
+}
+
+// Returns what changed, or null when there is nothing to redraw.
+function applyFrame(d){
+  if(d.type === 'snapshot'){
+    seq = d.seq;
+    return wholeFrame(d);
+  }
+  if(d.type === 'heartbeat'){
+    if(seq === null || d.seq !== seq) requestResync();
+    return null;
+  }
+  if(d.type === 'delta'){
+    if(seq === null || d.seq !== seq + 1){ requestResync(); return null; }
+    const changes = {combined:{}, status:{}};
+    SECTIONS.forEach(s=>{
+      if(d.combined && d.combined[s]){
+        state.combined[s] = changes.combined[s] = applySectionDelta(state.combined[s]||[], d.combined[s]);
+      }
+    });
+    // Status sections (mmdvm, p25, ysf, nxdn, ...) come whole when they change
+    Object.keys(d).forEach(k=>{ if(!NOT_STATUS.includes(k)) state[k] = changes.status[k] = d[k]; });
+    seq = d.seq;
+    return changes;
+  }
+  if(d.type) return null;   // query replies etc.
+  return wholeFrame(d);
+}
+
+// Reconnect with exponential backoff and jitter, so a restarted server
+// isn't hit by every open dashboard in the same second.
+function retryDelay(){
+  const cap = Math.min(30000, 1000 * Math.pow(2, attempt++));
+  return cap / 2 + Math.random() * cap / 2;
+}
+
+function connect(){
+  ws = new WebSocket(url);
+  state = null; seq = null;
+
+  ws.onopen = ()=>{ attempt = 0; console.log("WS connected:",url); };
+
+  ws.onclose = ()=>{
+    const delay = retryDelay();
+    console.warn("WS closed, retrying in", Math.round(delay), "ms");
+    setTimeout(connect, delay);
+  };
+
+  ws.onmessage = e=>{
+    const d = JSON.parse(e.data);
+    self.postMessage({uptime_seconds: d.uptime_seconds, changes: applyFrame(d)});
+  };
+}
+
+self.onmessage = e=>{ url = e.data.url; connect(); };
+</script>
+
 <script>
 const WS_HOST = "<?= htmlspecialchars($domain, ENT_QUOTES) ?>";
 const WS_PORT = <?= (int)$WS_PORT ?>;
 
-let ws, uptimeSeconds = 0, uptimeTimer;
+let uptimeSeconds = 0, uptimeTimer = null;
 
 function badge(src){
   const s=(src||'').toUpperCase();
@@ -179,83 +278,151 @@ function badge(src){
   if(s==='DMR')return'<span class="badge badge-dmr">DMR</span>';
   if(s==='P25')return'<span class="badge badge-p25">P25</span>';
   if(s==='YSF')return'<span class="badge badge-ysf">YSF</span>';
+  if(s==='NXDN')return'<span class="badge badge-nxdn">NXDN</span>';
   return src||'-';
 }
 
+// Hub mode: node(s) that saw the row
+function nodeTag(r){
+  const n = r.nodes || (r.node ? [r.node] : []);
+  return n.length ? ` <small class="text-muted">@${n.join(', ')}</small>` : '';
+}
+
+// The same worker code on the page itself, for browsers that refuse a
+// Blob worker.
+function inlineWorker(src){
+  const page = {onmessage:null, postMessage: d=>inner.onmessage({data:d})};
+  const inner = {onmessage:null, postMessage: d=>page.onmessage({data:d})};
+  new Function('self', src)(inner);
+  return page;
+}
+
 function startWS(){
   const proto = location.protocol === 'https:' ? 'wss' : 'ws';
-  const url = `${proto}://${WS_HOST}:${WS_PORT}`;
-  ws = new WebSocket(url);
-
-  ws.onopen = ()=>console.log("WS connected:",url);
+  // Pass view filters through, e.g. index.php?modes=DMR&tg=91 for a kiosk
+  const view = location.search.replace(/^\?/, '');
+  const url = `${proto}://${WS_HOST}:${WS_PORT}/?proto=delta${view ? '&' + view : ''}`;
+  const src = document.getElementById('ws-worker').textContent;
+  let worker;
+  try {
+    worker = new Worker(URL.createObjectURL(new Blob([src], {type:'text/javascript'})));
+  } catch(e) {
+    worker = inlineWorker(src);
+  }
+  worker.onmessage = onWorkerMessage;
+  worker.postMessage({url});
+}
 
-  ws.onclose = ()=>{
-    console.warn("WS closed, retrying...");
-    setTimeout(startWS,3000);
-  };
+// Changes from the worker pile up here and are drawn once per animation
+// frame (not at all while the tab is hidden).
+let pending = null;
+
+function onWorkerMessage(e){
+  const m = e.data;
+  if(m.uptime_seconds) setUptime(m.uptime_seconds);
+  if(!m.changes) return;
+  if(!pending){
+    pending = {combined:{}, status:{}};
+    requestAnimationFrame(()=>{ const c = pending; pending = null; render(c); });
+  }
+  Object.assign(pending.combined, m.changes.combined);
+  Object.assign(pending.status, m.changes.status);
+}
 
-  ws.onmessage = e=>{
-    const d = JSON.parse(e.data);
+function setUptime(s){
+  uptimeSeconds = s;
+  if(uptimeTimer) return;
+  uptimeTimer=setInterval(()=>{
+    uptimeSeconds++;
+    document.getElementById('uptime').innerText =
+      "Service uptime: " + Math.floor(uptimeSeconds) + "s";
+  },1000);
+}
 
-    if(d.uptime_seconds){
-      uptimeSeconds = d.uptime_seconds;
-      clearInterval(uptimeTimer);
-      uptimeTimer=setInterval(()=>{
-        uptimeSeconds++;
-        document.getElementById('uptime').innerText =
-          "Service uptime: " + uptimeSeconds + "s";
-      },1000);
+// Only the sections in c changed; everything else is left alone.
+function render(c){
+    const rows = c.combined;
+    if(rows.clients_talking){
+      patchTable('clients-talking-body', rows.clients_talking, 7, (r,i)=>[
+        i+1, badge(r.source), `${r.callsign}${r.name?' ('+r.name+')':''}${nodeTag(r)}`,
+        r.module||'-', r.status, r.start_time, r.end_time]);
     }
-
-    // Combined sections expected from server
-    if(d.combined){
-      renderTable('clients-talking-body', d.combined.clients_talking || [], 7, r=>`
-        <tr><td>${r.idx}</td><td>${badge(r.source)}</td><td>${r.callsign}</td>
-        <td>${r.module||'-'}</td><td>${r.status}</td>
-        <td>${r.start_time}</td><td>${r.end_time}</td></tr>`);
-
-      renderTable('last-heard-body', d.combined.last_heard || [], 6, r=>`
-        <tr><td>${r.idx}</td><td>${badge(r.source)}</td><td>${r.callsign}</td>
-        <td>${r.protocol}</td><td>${r.module_or_tg}</td>
-        <td>${r.timestamp}</td></tr>`);
-
-      renderTable('peers-body', d.combined.peers || [], 5, r=>`
-        <tr><td>${r.idx}</td><td>${r.callsign}</td><td>${r.module}</td>
-        <td>${r.ip_or_master}</td><td>${r.timestamp}</td></tr>`);
+    if(rows.last_heard){
+      patchTable('last-heard-body', rows.last_heard, 6, (r,i)=>[
+        i+1, badge(r.source), `${r.callsign}${nodeTag(r)}`,
+        r.protocol, r.module_or_tg, r.timestamp]);
+    }
+    if(rows.peers){
+      patchTable('peers-body', rows.peers, 5, (r,i)=>[
+        i+1, `${r.callsign}${nodeTag(r)}`, r.module, r.ip_or_master, r.timestamp]);
     }
 
+    const d = c.status;
     if(d.mmdvm){
-      const t=d.mmdvm.last_tx||{};
-      document.getElementById('mmdvm-body').innerHTML=`
-      <tr><td>${d.mmdvm.master}</td><td>${d.mmdvm.version}</td>
-      <td>${t.timestamp}</td><td>${t.src}</td><td>${t.dst}</td>
-      <td>${t.slot}</td><td>${t.cc}</td><td>${t.metadata}</td></tr>`;
+      patchTable('mmdvm-body', [d.mmdvm], 8, m=>{
+        const t=m.last_tx||{};
+        return [m.master, m.version, t.timestamp, t.callsign?t.callsign+' ('+t.src+')':t.src,
+                t.dst, t.slot, t.cc, t.metadata];
+      });
     }
 
     if(d.p25?.last_tx){
-      const t=d.p25.last_tx;
-      document.getElementById('p25-body').innerHTML=`
-      <tr><td>${t.timestamp}</td><td>${t.at}</td>
-      <td>${t.rid}</td><td>${t.tg}</td></tr>`;
+      patchTable('p25-body', [d.p25.last_tx], 4, t=>[t.timestamp, t.at, t.rid, t.tg]);
     }
 
     if(d.ysf){
-      const t=d.ysf.last_tx||{}, e2=d.ysf.last_event||{};
-      document.getElementById('ysf-body').innerHTML=`
-      <tr><td>${t.timestamp}</td><td>${t.callsign}</td>
-      <td>${t.dgid}</td><td>${t.note}</td><td>${e2.msg}</td></tr>`;
+      patchTable('ysf-body', [d.ysf], 5, y=>{
+        const t=y.last_tx||{}, e2=y.last_event||{};
+        return [t.timestamp, t.callsign, t.dgid, t.note, e2.msg];
+      });
+    }
+
+    if(d.nxdn){
+      document.getElementById('nxdn-section').style.display='';
+      const t=d.nxdn.last_tx;
+      if(t){
+        patchTable('nxdn-body', [t], 4, t=>[t.timestamp, t.callsign, t.dst, t.at]);
+      }
     }
-  };
 }
 
-function renderTable(id, rows, cols, fn){
+// Keyed rows: each row's <tr> is kept across updates (by the server's row
+// key) and moved into place; only cells whose markup changed are rewritten.
+function patchTable(id, rows, cols, cells){
+  const body = document.getElementById(id);
   if(!rows.length){
-    document.getElementById(id).innerHTML =
-      `<tr><td colspan="${cols}">No data</td></tr>`;
+    body._rows = null;
+    body.innerHTML = `<tr><td colspan="${cols}">No data</td></tr>`;
     return;
   }
-  document.getElementById(id).innerHTML =
-    rows.map((r,i)=>fn({...r,idx:i+1})).join('');
+  if(!body._rows){
+    body._rows = new Map();
+    body.innerHTML = '';   // placeholder row
+  }
+  const old = body._rows, next = new Map();
+  rows.forEach((r,i)=>{
+    let key = r.key != null ? r.key : i;   // status rows and older servers have no key
+    if(next.has(key)) key = key + '#' + i;
+    let tr = old.get(key);
+    if(!tr){
+      tr = document.createElement('tr');
+      tr._cells = [];
+    }
+    cells(r,i).forEach((h,j)=>{
+      h = `${h}`;
+      if(tr._cells[j] === h) return;
+      (tr.children[j] || tr.appendChild(document.createElement('td'))).innerHTML = h;
+      tr._cells[j] = h;
+    });
+    next.set(key, tr);
+  });
+  old.forEach((tr,key)=>{ if(next.get(key) !== tr) tr.remove(); });
+  let ref = body.firstChild;
+  next.forEach(tr=>{
+    if(tr === ref) ref = ref.nextSibling;
+    else body.insertBefore(tr, ref);
+  });
+  body._rows = next;
 }
 
 startWS();
@@ -36,9 +36,13 @@ install_deps() {
     apt-get update -y
     # Debian: use packaged websockets (PEP668-safe)
     apt-get install -y git python3 python3-websockets ca-certificates
+    # Optional: in-process journal reader (falls back to journalctl without it)
+    apt-get install -y python3-systemd || log "python3-systemd not available; using journalctl followers"
   elif [[ "$osfam" == "arch" ]]; then
     log "Installing dependencies via pacman..."
     pacman -Sy --noconfirm --needed git python python-websockets ca-certificates
+    # Optional: in-process journal reader (falls back to journalctl without it)
+    pacman -S --noconfirm --needed python-systemd || log "python-systemd not available; using journalctl followers"
   else
     echo "Unsupported OS (need apt or pacman)."
     exit 1
@@ -0,0 +1,23 @@
+import importlib.util
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = ("websocket_servernossl.py", "websocket_server.py")
+
+
+def load_server(filename):
+    """A fresh copy of one server script, imported as a module."""
+    name = "digidash_" + filename[:-3]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.DEBUG = False
+    module.load_modes()
+    return module
+
+
+@pytest.fixture(params=SERVERS)
+def server(request):
+    return load_server(request.param)
@@ -0,0 +1,46 @@
+import asyncio
+import os
+import stat
+
+import pytest
+
+
+def _start(server, path):
+    publisher = server.FanoutPublisher(path, 0)
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(publisher.start())
+    finally:
+        loop.close()
+
+
+def test_socket_is_private(server, tmp_path):
+    path = str(tmp_path / "fanout.sock")
+    _start(server, path)
+    st = os.lstat(path)
+    assert stat.S_ISSOCK(st.st_mode)
+    assert stat.S_IMODE(st.st_mode) == 0o600
+
+
+def test_stale_socket_is_replaced(server, tmp_path):
+    path = str(tmp_path / "fanout.sock")
+    _start(server, path)
+    _start(server, path)
+    assert stat.S_ISSOCK(os.lstat(path).st_mode)
+
+
+def test_other_files_are_not_removed(server, tmp_path):
+    path = tmp_path / "fanout.sock"
+    path.write_text("not ours to delete")
+    with pytest.raises(RuntimeError):
+        _start(server, str(path))
+    assert path.read_text() == "not ours to delete"
+
+
+def test_default_path_is_in_a_private_directory(server, monkeypatch):
+    monkeypatch.delenv("RUNTIME_DIRECTORY", raising=False)
+    path = server.fanout_socket_path()
+    st = os.lstat(os.path.dirname(path))
+    assert st.st_uid == os.getuid()
+    assert stat.S_IMODE(st.st_mode) == 0o700
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import websockets
+
+
+def _lh(callsign, epoch, source="DMR", target="TG 91"):
+    return {"source": source, "callsign": callsign, "protocol": source,
+            "module_or_tg": target, "timestamp": "-", "epoch": epoch}
+
+
+def _talking(callsign, start, source="DMR", module="S2 / TG 91"):
+    return {"source": source, "callsign": callsign, "module": module, "status": "talking",
+            "start_time": "-", "end_time": None, "start_epoch": start}
+
+
+def _merge_from_stand_ins(server, upstreams):
+    """
+    Serves each {node: combined} as a stand-in DigiDash node on localhost,
+    points the hub at them and returns the merged combined sections.
+    """
+    async def run():
+        stand_ins = []
+        args = []
+        for name, combined in upstreams.items():
+            snapshot = {"type": "snapshot", "seq": 1, "uptime_seconds": 1, "combined": combined}
+
+            async def handler(ws, path, snapshot=snapshot):
+                await ws.send(json.dumps(snapshot))
+                await ws.wait_closed()
+
+            stand_in = await websockets.serve(handler, "127.0.0.1", 0)
+            stand_ins.append(stand_in)
+            args += ["--upstream", "{}=ws://127.0.0.1:{}/".format(name, stand_in.sockets[0].getsockname()[1])]
+        assert server.setup_hub(server.parse_args(args))
+        loops = [asyncio.ensure_future(server.upstream_loop(node)) for node in server.hub_nodes]
+        for _ in range(200):
+            if all(node.seq == 1 for node in server.hub_nodes):
+                break
+            await asyncio.sleep(0.01)
+        merged = server.merge_hub_rows(server.hub_nodes, 5, 10)
+        for task in loops:
+            task.cancel()
+        for stand_in in stand_ins:
+            stand_in.close()
+            await stand_in.wait_closed()
+        return merged
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def _rows(section):
+    return [(r["callsign"], r["source"], r["nodes"]) for r in section]
+
+
+def test_echo_across_nodes_is_merged(server):
+    merged = _merge_from_stand_ins(server, {
+        "north": {"clients_talking": [_talking("K1ABC", 2000)], "last_heard": [_lh("N0CALL", 1000)], "peers": []},
+        "south": {"clients_talking": [_talking("K1ABC", 2001)], "last_heard": [_lh("N0CALL", 1002)], "peers": []},
+    })
+    assert _rows(merged["clients_talking"]) == [("K1ABC", "DMR", ["north", "south"])]
+    assert _rows(merged["last_heard"]) == [("N0CALL", "DMR", ["south", "north"])]
+
+
+def test_one_node_never_echoes_itself(server):
+    merged = _merge_from_stand_ins(server, {
+        "north": {"clients_talking": [], "peers": [],
+                  "last_heard": [_lh("N0CALL", 1004), _lh("N0CALL", 1000)]},
+    })
+    assert [r["epoch"] for r in merged["last_heard"]] == [1004, 1000]
+
+
+def test_different_modes_are_not_echoes(server):
+    merged = _merge_from_stand_ins(server, {
+        "north": {"last_heard": [], "peers": [],
+                  "clients_talking": [_talking("K1ABC", 2000),
+                                      _talking("K1ABC", 2000.5, source="YSF", module="DG-ID 0")]},
+    })
+    assert _rows(merged["clients_talking"]) == [("K1ABC", "DMR", ["north"]), ("K1ABC", "YSF", ["north"])]
+
+
+def test_different_talkgroups_are_not_echoes(server):
+    merged = _merge_from_stand_ins(server, {
+        "north": {"clients_talking": [], "peers": [], "last_heard": [_lh("N0CALL", 1000)]},
+        "south": {"clients_talking": [], "peers": [], "last_heard": [_lh("N0CALL", 1001, target="TG 3100")]},
+    })
+    assert len(merged["last_heard"]) == 2
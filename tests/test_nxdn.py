@@ -0,0 +1,32 @@
+def _nxdn(server):
+    return [m for m in server.declarative_modes if m.key == "nxdn"][0]
+
+
+def _replay(server, tmp_path, lines):
+    capture = tmp_path / "nxdn.log"
+    capture.write_text("".join(
+        "2026-02-01T22:14:{:02d}.000000+0000 host MMDVM_Bridge[5]: {}\n".format(i, line)
+        for i, line in enumerate(lines)))
+    records, skipped = server.load_capture("nxdn", str(capture))
+    assert skipped == 0
+    mode = _nxdn(server)
+    for epoch, _mode, msg in records:
+        server.enqueue_record(mode.queue, (epoch, server.format_journal_ts(epoch), msg))
+    mode.parse()
+    return mode
+
+
+def test_rf_voice_header_starts_a_talker(server, tmp_path):
+    mode = _replay(server, tmp_path, ["NXDN, received RF voice header from K2NX to TG 65000"])
+    assert mode.talker["callsign"] == "K2NX"
+    assert mode.talker["module"] == "TG 65000"
+    assert mode.talker["status"] == "talking"
+
+
+def test_rf_voice_header_then_end(server, tmp_path):
+    mode = _replay(server, tmp_path, [
+        "NXDN, received RF voice header from K2NX to TG 65000",
+        "NXDN, received RF end of transmission, 2.1 seconds, BER: 0.0%",
+    ])
+    assert mode.talker["status"] == "not talking"
+    assert server.last_heard.newest(1)[0]["callsign"] == "K2NX"
@@ -0,0 +1,19 @@
+import random
+
+
+def test_rolling_totals_match_buckets(server):
+    counter = server.RollingCounter(3600, 168)
+    rng = random.Random(7)
+    epoch = 1760000000.0
+    for _ in range(20000):
+        epoch += rng.uniform(0, 60)
+        counter.add(epoch, rng.uniform(0.3, 12.7))
+    assert abs(sum(counter.talk) - counter.talk_total) < 1e-6
+    assert sum(counter.keyups) == counter.keyup_total
+
+
+def test_large_bucket_keeps_sub_second_talk(server):
+    counter = server.RollingCounter(3600, 168)
+    counter.add(1760000000.0, 1000000.0)
+    counter.add(1760000001.0, 0.1)
+    assert abs(counter.recent(1)[0] - 1000000.1) < 1e-6
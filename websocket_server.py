@@ -2,7 +2,11 @@
 # Python 3.5 compatible websocket server (SSL/TLS)
 # Reads directly from journald and logs activity to journald (stdout)
 
+import argparse
 import asyncio
+import http
+import os
+import queue
 import websockets
 import ssl
 import re
@@ -10,8 +14,42 @@ import json
 import time
 import threading
 import subprocess
+import socket
+import stat
+import sys
+import struct
+import zlib
+import heapq
+import mmap
 from datetime import datetime
-from collections import deque
+from array import array
+from bisect import bisect_left
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit, urlunsplit, parse_qs
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+# Optional: in-process journal reader (python3-systemd / python-systemd)
+try:
+    from systemd import journal as systemd_journal
+except ImportError:
+    systemd_journal = None
+
+# Optional: C MessagePack encoder; a pure-Python packer is used without it
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+except ImportError:
+    ServerPerMessageDeflateFactory = None
 
 # -----------------------------
 # CONFIG (TLS)
@@ -30,22 +68,155 @@ ENABLE_YSF = True
 # If True: if a service unit doesn't exist on this machine, auto-disable that mode.
 AUTO_DISABLE_MISSING_UNITS = True
 
+# Journal ingestion backend:
+#   "auto"       - in-process systemd journal reader if python3-systemd is installed,
+#                  otherwise one journalctl -o json for all units
+#   "native"     - in-process reader (falls back to "json" if it can't open)
+#   "json"       - one journalctl -f -o json process for all units
+#   "journalctl" - legacy: one text journalctl -f per unit
+JOURNAL_BACKEND = "auto"
+
 M17_UNIT = "mrefd.service"
 DMR_UNIT = "mmdvm_bridge.service"
 P25_UNIT = "p25reflector.service"
 YSF_UNIT = "mmdvm_bridgeysf.service"
 
+# NXDN: NXDNReflector, or an MMDVM_Bridge instance running NXDN (set the unit
+# to yours, e.g. "mmdvm_bridgenxdn.service"). Both log formats are matched.
+ENABLE_NXDN = True
+NXDN_UNIT = "nxdnreflector.service"
+
+# Declarative modes: single-talker modes described by their log lines rather
+# than a hand-written parser. Each entry:
+#   name      label used for the source/protocol columns
+#   enabled   only enabled entries are compiled and followed
+#   unit      systemd unit to read (auto-disabled like the others if missing)
+#   status    payload key for a {"last_tx": {...}} status section (optional)
+#   keywords  cheap substring prefilter, checked before any regex (optional)
+#   events    (kind, regex) pairs; kind is "start", "end" or "alias". Named
+#             groups become fields for the templates below.
+#   talker    templates for the talker row: "callsign" and "module"
+#   last_tx   templates for the status section's last_tx on "start"
+# Templates are str.format strings over the event's fields; a field the
+# event doesn't have renders as "-".
+MODE_DEFINITIONS = [
+    {
+        "name": "NXDN",
+        "enabled": ENABLE_NXDN,
+        "unit": NXDN_UNIT,
+        "status": "nxdn",
+        "keywords": ("ransmission", "voice header", "watchdog"),
+        "events": [
+            # MMDVM_Bridge / MMDVMHost
+            ("start", r"\bNXDN,\s+received (?:network|RF) (?:transmission|voice header) from\s+(?P<callsign>\S+)\s+to\s+(?P<dst>.+?)\s*$"),
+            ("end", r"\bNXDN,\s+received (?:network|RF) end of transmission\b"),
+            ("end", r"\bNXDN,\s+network watchdog has expired\b"),
+            # NXDNReflector
+            ("start", r"\bTransmission from\s+(?P<callsign>\S+)\s+at\s+(?P<at>\S+)\s+to\s+(?P<dst>.+?)\s*$"),
+            ("end", r"\bReceived end of transmission\b"),
+        ],
+        "talker": {"callsign": "{callsign}", "module": "{dst}"},
+        "last_tx": {"callsign": "{callsign}", "dst": "{dst}", "at": "{at}"},
+    },
+]
+
 ASL_BASE_CALLSIGN = "CALLSIGN"
 ASL_LABEL_SOURCE  = "ASL"
 ASL_LABEL_CALL    = "ASL-Bridge NODEID"
 SUPPRESS_ASL_WHEN_EXTERNAL_TALKING = True
 
 EXPIRE_SECONDS = 300
+# mrefd doesn't log keepalives, so a peer whose disconnect line was never
+# seen (reflector restart, journal gap) is dropped after this long.
+# 0 keeps peers until a disconnect is logged.
+PEER_EXPIRE_SECONDS = 6 * 3600
 LAST_HEARD_DEDUP_SECONDS = 3
 MAX_QUEUE = 2000
+# Followers read journalctl output in blocks of up to this many bytes
+READ_CHUNK_BYTES = 65536
+
+# Transmission history (SQLite, WAL). Every last-heard entry is appended here
+# so the dashboard comes back populated after a restart. Keep the file small
+# on SD cards with the retention settings (0 = no limit).
+ENABLE_HISTORY = True
+HISTORY_DB_PATH = "/var/lib/digidash/history.db"
+HISTORY_RETENTION_DAYS = 30
+HISTORY_MAX_ROWS = 100000
+HISTORY_FLUSH_SECONDS = 2.0
+# Websocket history queries ({"type":"history"}): rows per page
+HISTORY_QUERY_DEFAULT_ROWS = 50
+HISTORY_QUERY_MAX_ROWS = 500
+
+# Activity statistics: talk time and key-ups per callsign and per talkgroup
+# over the last hour, day and week, counted since the service started. At
+# most STATS_MAX_KEYS callsigns (and as many talkgroups) are tracked; the
+# least recently heard is dropped first, so memory stays fixed.
+ENABLE_STATS = True
+STATS_MAX_KEYS = 2000
+
+# DMR ID database kept current by dmridupdater.sh. Used to show callsign and
+# name for bare numeric DMR IDs; the file is re-read when it is replaced.
+# Set DMRID_FILE = None to turn the lookup off.
+DMRID_FILE = "/var/lib/mmdvm/DMRIds.dat"
+DMRID_RELOAD_CHECK_SECONDS = 60
 DEBUG = True
 HEARTBEAT_SECONDS = 10
 
+# Prometheus-style metrics on the websocket port: GET /metrics returns
+# ingest, parse/build timing, frame size and client send counters.
+ENABLE_METRICS = True
+METRICS_PATH = "/metrics"
+
+# GET SNAPSHOT_PATH on the websocket port returns the current full payload as
+# JSON, for pollers that don't want to hold a websocket open. Responses carry
+# an ETag; a poll with a matching If-None-Match gets an empty 304.
+ENABLE_SNAPSHOT_HTTP = True
+SNAPSHOT_PATH = "/snapshot.json"
+
+# permessage-deflate for every client that offers it (all current browsers).
+# Context takeover stays on, so keys repeated from frame to frame cost almost
+# nothing; the small window and memLevel keep zlib at ~32 KB per connection
+# instead of ~256 KB with the zlib defaults.
+WS_COMPRESSION = True
+WS_DEFLATE_WINDOW_BITS = 12
+WS_DEFLATE_MEM_LEVEL = 5
+
+# Push pipeline: followers wake the event loop as soon as lines arrive.
+# Bursts are coalesced for PUSH_COALESCE_SECONDS before one push goes out;
+# SNAPSHOT_HEARTBEAT_SECONDS is the idle re-send interval (uptime, liveness).
+PUSH_COALESCE_SECONDS = 0.05
+SNAPSHOT_HEARTBEAT_SECONDS = 1.0
+
+# Hub mode (--hub): instead of reading the local journal, follow other
+# DigiDash servers over the delta protocol and serve one merged view. The
+# hub holds one connection per node however many viewers it has. Rows are
+# tagged with "node"; the same transmission seen on several bridged nodes
+# within HUB_DEDUP_SECONDS is shown once, with every node in "nodes".
+HUB_UPSTREAMS = [
+    # {"node": "north", "url": "ws://192.0.2.10:8765/"},
+    # {"node": "south", "url": "wss://south.example.org:8765/", "verify_tls": False},
+]
+HUB_DEDUP_SECONDS = 5
+HUB_LAST_HEARD = 10
+HUB_RECONNECT_SECONDS = 2
+HUB_RECONNECT_MAX_SECONDS = 60
+
+# Fan-out workers (--workers N): this process keeps the followers, parsers,
+# history and stats, and N worker processes sharing WS_PORT (SO_REUSEPORT)
+# serve the clients, so big audiences use every core. 0 = one process.
+# FANOUT_SOCKET is the local Unix socket between them. None puts it in a
+# directory only this user can open: $RUNTIME_DIRECTORY (RuntimeDirectory=
+# in the .service file, i.e. /run/digidash) or else /tmp/digidash-<uid>.
+FANOUT_WORKERS = 0
+FANOUT_SOCKET = None
+
+# Per-client send queue. Once CLIENT_SEND_QUEUE frames are waiting for a
+# slow viewer, its backlog is replaced by the newest frame (delta clients:
+# one fresh snapshot); a viewer still backed up after CLIENT_STALL_SECONDS
+# is disconnected.
+CLIENT_SEND_QUEUE = 8
+CLIENT_STALL_SECONDS = 30
+
 # Require >=2 bridged modes to show ASL (keeps it from showing on single-mode blips)
 ASL_MIN_MODES_FOR_ROLLUP = 2
 
@@ -69,6 +240,70 @@ def log_flush(msg):
     except Exception:
         pass
 
+# -----------------------------
+# Clock
+# -----------------------------
+# Parsers, expiry and the builders ask now_epoch() for "now" instead of
+# calling time.time() directly, so the replay harness can run them on the
+# recorded journal time.
+class SystemClock(object):
+    def time(self):
+        return time.time()
+
+clock = SystemClock()
+
+def now_epoch():
+    return clock.time()
+
+# -----------------------------
+# Metrics (served at METRICS_PATH)
+# -----------------------------
+class Histogram(object):
+    """Cumulative-bucket histogram rendered in Prometheus text format."""
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def state(self):
+        return [list(self.counts), self.count, self.sum]
+
+    def render(self, out, state=None):
+        counts, count, total = state or self.state()
+        out.append("# HELP {} {}".format(self.name, self.help_text))
+        out.append("# TYPE {} histogram".format(self.name))
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            out.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+        out.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, count))
+        out.append("{}_sum {}".format(self.name, total))
+        out.append("{}_count {}".format(self.name, count))
+
+_SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+metric_parse_seconds = Histogram("digidash_parse_seconds",
+    "Time to drain and parse the journal queues for one snapshot", _SECONDS_BUCKETS)
+metric_build_seconds = Histogram("digidash_snapshot_build_seconds",
+    "Time to build and diff one snapshot, parsing included", _SECONDS_BUCKETS)
+metric_frame_bytes = Histogram("digidash_frame_bytes",
+    "Size of each encoded websocket frame", (256, 1024, 4096, 16384, 65536, 262144, 1048576))
+metric_send_seconds = Histogram("digidash_send_seconds",
+    "Time for one websocket send to complete", (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+metric_history_query_seconds = Histogram("digidash_history_query_seconds",
+    "Time to answer one websocket history query", _SECONDS_BUCKETS)
+send_counters = {"frames": 0, "bytes": 0, "failed": 0, "coalesced": 0, "slow_disconnects": 0}
+
 # -----------------------------
 # Helpers
 # -----------------------------
@@ -89,28 +324,95 @@ def systemd_unit_exists(unit_name):
     except Exception:
         return False
 
+def probe_units(units):
+    """
+    Resolves which units exist with one `systemctl show` for all of them
+    (unlike `systemctl status` it doesn't read the journal). Falls back to
+    per-unit `systemctl status` probes run in parallel if that output can't
+    be used. Returns ({unit: exists}, method).
+    """
+    wanted = []
+    for u in units:
+        if u not in wanted:
+            wanted.append(u)
+    if not wanted:
+        return {}, "none"
+
+    try:
+        p = subprocess.Popen(
+            ["systemctl", "show", "-p", "Id", "-p", "LoadState"] + wanted,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True
+        )
+        out, _ = p.communicate(timeout=10)
+        # one block of properties per unit, in the order asked, blank-line separated
+        blocks = [b for b in out.strip().split("\n\n")] if out.strip() else []
+        if p.returncode == 0 and len(blocks) == len(wanted):
+            result = {}
+            for unit, block in zip(wanted, blocks):
+                props = dict(line.split("=", 1) for line in block.splitlines() if "=" in line)
+                result[unit] = props.get("LoadState", "not-found") not in ("not-found", "")
+            return result, "systemctl show"
+    except Exception:
+        pass
+
+    result = {}
+
+    def probe(unit):
+        result[unit] = systemd_unit_exists(unit)
+
+    threads = [threading.Thread(target=probe, args=(u,)) for u in wanted]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return result, "parallel systemctl status"
+
 def apply_auto_disable():
     global ENABLE_M17, ENABLE_DMR, ENABLE_P25, ENABLE_YSF
 
     if not AUTO_DISABLE_MISSING_UNITS:
         return
 
-    if ENABLE_M17 and not systemd_unit_exists(M17_UNIT):
+    units = []
+    if ENABLE_M17:
+        units.append(M17_UNIT)
+    if ENABLE_DMR:
+        units.append(DMR_UNIT)
+    if ENABLE_P25:
+        units.append(P25_UNIT)
+    if ENABLE_YSF:
+        units.append(YSF_UNIT)
+    units.extend(mode.unit for mode in declarative_modes)
+
+    t0 = time.monotonic()
+    exists, method = probe_units(units)
+    log_flush("Unit probe: {} units in {:.3f}s ({})".format(len(units), time.monotonic() - t0, method))
+
+    if ENABLE_M17 and not exists.get(M17_UNIT):
         ENABLE_M17 = False
         log_flush("Auto-disabled M17 (missing unit: {})".format(M17_UNIT))
 
-    if ENABLE_DMR and not systemd_unit_exists(DMR_UNIT):
+    if ENABLE_DMR and not exists.get(DMR_UNIT):
         ENABLE_DMR = False
         log_flush("Auto-disabled DMR (missing unit: {})".format(DMR_UNIT))
 
-    if ENABLE_P25 and not systemd_unit_exists(P25_UNIT):
+    if ENABLE_P25 and not exists.get(P25_UNIT):
         ENABLE_P25 = False
         log_flush("Auto-disabled P25 (missing unit: {})".format(P25_UNIT))
 
-    if ENABLE_YSF and not systemd_unit_exists(YSF_UNIT):
+    if ENABLE_YSF and not exists.get(YSF_UNIT):
         ENABLE_YSF = False
         log_flush("Auto-disabled YSF (missing unit: {})".format(YSF_UNIT))
 
+    for mode in list(declarative_modes):
+        if not exists.get(mode.unit):
+            declarative_modes.remove(mode)
+            log_flush("Auto-disabled {} (missing unit: {})".format(mode.name, mode.unit))
+
+
 def get_uptime_seconds():
     try:
         with open("/proc/uptime", "r") as f:
@@ -128,7 +430,7 @@ def parse_syslog_time(ts):
         return None
 
 def now_syslog_ts():
-    return datetime.now().strftime("%b %d %H:%M:%S")
+    return datetime.fromtimestamp(now_epoch()).strftime("%b %d %H:%M:%S")
 
 def normalize_callsign(val):
     if val is None:
@@ -141,31 +443,209 @@ def is_local_origin(callsign_or_id):
     s = str(callsign_or_id).strip().upper()
     return s.startswith(ASL_BASE_CALLSIGN.upper())
 
-def expire_talker(talker_dict, expire_seconds):
-    now = time.time()
-    if not talker_dict.get("callsign"):
-        return
-    ref_ts = talker_dict.get("last_event_time") or talker_dict.get("end_time") or talker_dict.get("start_time")
-    ref_epoch = parse_syslog_time(ref_ts) if ref_ts else None
-    if talker_dict.get("status") != "talking" and ref_epoch is not None and (now - ref_epoch) > expire_seconds:
-        talker_dict["callsign"] = None
-        talker_dict["module"] = None
-        talker_dict["status"] = None
-        talker_dict["start_time"] = None
-        talker_dict["end_time"] = None
-        talker_dict["last_event_time"] = None
-        talker_dict["extra"] = {}
+def clear_talker(talker_dict):
+    talker_dict["callsign"] = None
+    talker_dict["module"] = None
+    talker_dict["status"] = None
+    talker_dict["start_time"] = None
+    talker_dict["end_time"] = None
+    talker_dict["last_event_time"] = None
+    talker_dict["start_epoch"] = None
+    talker_dict["end_epoch"] = None
+    talker_dict["last_event_epoch"] = None
+    talker_dict["extra"] = {}
+
+def talker_deadline(talker_dict, expire_seconds):
+    """Epoch after which an idle talker is cleared, or None if it shouldn't be."""
+    if not talker_dict.get("callsign") or talker_dict.get("status") == "talking":
+        return None
+    ref_epoch = talker_dict.get("last_event_epoch") or talker_dict.get("end_epoch") or talker_dict.get("start_epoch")
+    if ref_epoch is None:
+        return None
+    return ref_epoch + expire_seconds
+
+# -----------------------------
+# Expiry scheduler
+# -----------------------------
+# Everything that ages out (idle talkers, ended M17 streams, M17 peers) gets
+# a deadline here when the parser changes it, instead of being re-checked on
+# every snapshot. Rescheduling or cancelling only replaces the live entry in
+# `deadlines`; the old heap entry is skipped when it reaches the top.
+class ExpiryScheduler(object):
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+        self.expired = 0
+
+    def schedule(self, key, deadline, handler, arg):
+        """key is a tuple of strings; handler(arg) runs once deadline has passed."""
+        live = self.deadlines.get(key)
+        if live is not None and live[0] == deadline:
+            return
+        self.deadlines[key] = (deadline, handler, arg)
+        heapq.heappush(self.heap, (deadline, key))
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(d[0], k) for k, d in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+
+    def next_deadline(self):
+        heap = self.heap
+        while heap:
+            deadline, key = heap[0]
+            live = self.deadlines.get(key)
+            if live is not None and live[0] == deadline:
+                return deadline
+            heapq.heappop(heap)
+        return None
+
+    def run(self, now):
+        """Fire every entry whose deadline is behind now. Returns how many changed state."""
+        heap = self.heap
+        fired = 0
+        while heap and heap[0][0] < now:
+            deadline, key = heapq.heappop(heap)
+            live = self.deadlines.get(key)
+            if live is None or live[0] != deadline:
+                continue
+            del self.deadlines[key]
+            if live[1](live[2]):
+                fired += 1
+        self.expired += fired
+        return fired
+
+    def pending(self):
+        return len(self.deadlines)
+
+expiry = ExpiryScheduler()
+
+def _expire_talker(talker_dict):
+    if talker_deadline(talker_dict, EXPIRE_SECONDS) is None:
+        return False
+    clear_talker(talker_dict)
+    return True
+
+def schedule_talker_expiry(talker_dict):
+    key = ("talker", talker_dict["source"])
+    deadline = talker_deadline(talker_dict, EXPIRE_SECONDS)
+    if deadline is None:
+        expiry.cancel(key)
+    else:
+        expiry.schedule(key, deadline, _expire_talker, talker_dict)
+
+def _expire_m17_client(cs):
+    info = clients_talking.get(cs)
+    if info is None or info.get("status") == "talking":
+        return False
+    del clients_talking[cs]
+    return True
+
+def _expire_peer(key):
+    return peers.pop(key, None) is not None
+
+def forget_peer(key):
+    peers.pop(key, None)
+    expiry.cancel(("peer", key))
 
 # -----------------------------
-# Journal follower thread
+# Journal followers
 # -----------------------------
+# Every follower hands the parsers the same record:
+#     (epoch, display_ts, message)
+# epoch is float seconds straight from journald, display_ts is what the
+# dashboard shows. Parsers never split prefixes or parse time strings.
+
+def format_journal_ts(epoch):
+    # Same shape as journalctl -o short: Feb 01 22:14:00
+    return time.strftime("%b %d %H:%M:%S", time.localtime(epoch))
+
+def enqueue_record(q, record):
+    try:
+        q.append(record)
+        q.ingested += 1
+        if len(q) > MAX_QUEUE:
+            q.popleft()
+            q.dropped += 1
+    except Exception:
+        pass
+
+def enqueue_records(q, records):
+    """
+    Hands a whole batch to a queue in one go, trimming to MAX_QUEUE once.
+    Returns how many of the oldest lines had to be dropped (also counted on
+    the queue).
+    """
+    n = len(records)
+    if not n:
+        return 0
+    dropped = 0
+    try:
+        if n >= MAX_QUEUE:
+            dropped = len(q) + n - MAX_QUEUE
+            q.clear()
+            q.extend(records[n - MAX_QUEUE:])
+        else:
+            q.extend(records)
+            over = len(q) - MAX_QUEUE
+            for _ in range(over):
+                q.popleft()
+                dropped += 1
+    except IndexError:
+        # the parser drained it meanwhile
+        pass
+    q.ingested += n
+    q.dropped += dropped
+    return dropped
+
+def read_line_blocks(stream, chunk_size=READ_CHUNK_BYTES):
+    """
+    Yields lists of complete lines from a binary pipe. os.read returns
+    whatever is already there (up to chunk_size), so a quiet pipe still
+    yields one line at a time while a catch-up burst comes out in large
+    blocks that are decoded and split in one call each.
+    """
+    fd = stream.fileno()
+    tail = b""
+    while True:
+        chunk = os.read(fd, chunk_size)
+        if not chunk:
+            break
+        data = tail + chunk if tail else chunk
+        cut = data.rfind(b"\n")
+        if cut < 0:
+            tail = data
+            continue
+        tail = data[cut + 1:]
+        yield data[:cut].decode("utf-8", "replace").split("\n")
+    if tail:
+        yield [tail.decode("utf-8", "replace")]
+
+def journal_message_text(msg):
+    # journald hands out non-UTF-8 MESSAGE fields as bytes (native) or a
+    # list of byte values (JSON output)
+    if isinstance(msg, list):
+        msg = bytes(msg)
+    if isinstance(msg, bytes):
+        msg = msg.decode("utf-8", "replace")
+    return msg
+
+_ts_frac_re = re.compile(r"\.\d+")
+
 class JournalFollower(object):
+    """
+    Legacy text follower: one journalctl -o short per unit.
+    Only used with JOURNAL_BACKEND = "journalctl".
+    """
     def __init__(self, unit_name, line_queue):
         self.unit_name = unit_name
         self.q = line_queue
         self._stop = False
         self._proc = None
         self._thread = None
+        self._ts_key = None
+        self._ts_epoch = None
         self.last_line_time = None
         self.spawn_count = 0
         self.dead_count = 0
@@ -192,27 +672,37 @@ class JournalFollower(object):
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1
+            bufsize=0
         )
 
+    def _epoch(self, sys_ts):
+        # Whole seconds, like before; consecutive lines mostly share one,
+        # so the strptime runs once per second of log rather than per line.
+        key = _ts_frac_re.sub("", sys_ts, 1)
+        if key != self._ts_key:
+            self._ts_key = key
+            self._ts_epoch = parse_syslog_time(key)
+        return self._ts_epoch
+
     def _run(self):
         while not self._stop:
             try:
                 self._spawn()
-                while not self._stop:
-                    line = self._proc.stdout.readline()
-                    if not line:
+                for lines in read_line_blocks(self._proc.stdout):
+                    if self._stop:
                         break
-                    line = line.rstrip("\n")
-                    if line:
-                        self.last_line_time = time.time()
-                    try:
-                        self.q.append(line)
-                        if len(self.q) > MAX_QUEUE:
-                            self.q.popleft()
-                    except Exception:
-                        pass
+                    self.last_line_time = time.time()
+                    batch = []
+                    for line in lines:
+                        sys_ts, _src, msg = split_syslog(line)
+                        if not sys_ts or not msg:
+                            continue
+                        batch.append((self._epoch(sys_ts), sys_ts, msg))
+                    if batch:
+                        dropped = enqueue_records(self.q, batch)
+                        if dropped:
+                            log_flush("Queue overflow [{}]: dropped {} oldest lines (MAX_QUEUE={})".format(self.unit_name, dropped, MAX_QUEUE))
+                        notify_push()
             except Exception as e:
                 self.last_error = str(e)
                 log_flush("Follower exception [{}]: {}".format(self.unit_name, e))
@@ -220,30 +710,240 @@ class JournalFollower(object):
             log_flush("Follower for {} ended (dead #{})".format(self.unit_name, self.dead_count))
             time.sleep(1.0)
 
+    def queue_depth(self):
+        return len(self.q)
+
+class JsonJournalFollower(object):
+    """
+    One journalctl -o json process for all units (-u repeated). Each entry
+    is routed to its mode queue by _SYSTEMD_UNIT, with the timestamp taken
+    from __REALTIME_TIMESTAMP instead of being parsed back out of text.
+    """
+    def __init__(self, routes):
+        self.routes = dict(routes)  # unit -> queue
+        self.unit_name = ",".join(u for u, _q in routes)
+        self._stop = False
+        self._proc = None
+        self._thread = None
+        self.last_line_time = None
+        self.spawn_count = 0
+        self.dead_count = 0
+        self.last_error = None
+
+    def start(self):
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        self._thread = t
+        t.start()
+
+    def _spawn(self):
+        cmd = ["journalctl", "--no-pager", "--quiet", "-f", "-n", "0", "-o", "json"]
+        for unit in self.routes:
+            cmd.extend(["-u", unit])
+        self.spawn_count += 1
+        log_flush("Starting JSON follower for {} (spawn #{})".format(self.unit_name, self.spawn_count))
+
+        self._proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0
+        )
+
+    def _parse_line(self, line):
+        """(unit, record) for an entry of one of our units, else None."""
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        unit = entry.get("_SYSTEMD_UNIT")
+        if unit not in self.routes:
+            return None
+        msg = journal_message_text(entry.get("MESSAGE"))
+        if not msg:
+            return None
+        try:
+            epoch = int(entry["__REALTIME_TIMESTAMP"]) / 1000000.0
+        except Exception:
+            epoch = time.time()
+        return unit, (epoch, format_journal_ts(epoch), msg)
+
+    def _run(self):
+        while not self._stop:
+            try:
+                self._spawn()
+                for lines in read_line_blocks(self._proc.stdout):
+                    if self._stop:
+                        break
+                    self.last_line_time = time.time()
+                    batches = {}
+                    for line in lines:
+                        parsed = self._parse_line(line)
+                        if parsed is not None:
+                            batches.setdefault(parsed[0], []).append(parsed[1])
+                    for unit, batch in batches.items():
+                        dropped = enqueue_records(self.routes[unit], batch)
+                        if dropped:
+                            log_flush("Queue overflow [{}]: dropped {} oldest lines (MAX_QUEUE={})".format(unit, dropped, MAX_QUEUE))
+                    if batches:
+                        notify_push()
+            except Exception as e:
+                self.last_error = str(e)
+                log_flush("JSON follower exception: {}".format(e))
+            self.dead_count += 1
+            log_flush("JSON follower for {} ended (dead #{})".format(self.unit_name, self.dead_count))
+            time.sleep(1.0)
+
+    def queue_depth(self):
+        return sum(len(q) for q in self.routes.values())
+
+class NativeJournalFollower(object):
+    """
+    Reads journald in-process for all configured units at once (matches on
+    _SYSTEMD_UNIT) and routes each entry to its mode queue. No child
+    processes, no pipes, no respawn gap.
+    """
+    def __init__(self, routes):
+        self.routes = dict(routes)  # unit -> queue
+        self.unit_name = ",".join(u for u, _q in routes)
+        self._stop = False
+        self._thread = None
+        self.last_line_time = None
+        self.spawn_count = 0
+        self.dead_count = 0
+        self.last_error = None
+
+    def start(self):
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        self._thread = t
+        t.start()
+
+    def _open(self):
+        j = systemd_journal.Reader()
+        # Matches on the same field are OR'ed together
+        for unit in self.routes:
+            j.add_match(_SYSTEMD_UNIT=unit)
+        # Start at the end, like journalctl -n 0
+        j.seek_tail()
+        j.get_previous()
+        self.spawn_count += 1
+        log_flush("Opened native journal reader for {} (open #{})".format(self.unit_name, self.spawn_count))
+        return j
+
+    def _run(self):
+        while not self._stop:
+            try:
+                j = self._open()
+                while not self._stop:
+                    if j.wait(1.0) == systemd_journal.NOP:
+                        continue
+                    got = False
+                    for entry in j:
+                        q = self.routes.get(entry.get("_SYSTEMD_UNIT"))
+                        if q is None:
+                            continue
+                        msg = journal_message_text(entry.get("MESSAGE"))
+                        if not msg:
+                            continue
+                        rt = entry.get("__REALTIME_TIMESTAMP")
+                        epoch = rt.timestamp() if rt is not None else time.time()
+                        enqueue_record(q, (epoch, format_journal_ts(epoch), msg))
+                        got = True
+                    if got:
+                        self.last_line_time = time.time()
+                        notify_push()
+            except Exception as e:
+                self.last_error = str(e)
+                log_flush("Native journal reader exception: {}".format(e))
+            self.dead_count += 1
+            log_flush("Native journal reader ended (dead #{})".format(self.dead_count))
+            time.sleep(1.0)
+
+    def queue_depth(self):
+        return sum(len(q) for q in self.routes.values())
+
+def native_journal_available():
+    if JOURNAL_BACKEND not in ("auto", "native") or systemd_journal is None:
+        return False
+    try:
+        systemd_journal.Reader().close()
+        return True
+    except Exception as e:
+        log_flush("Native journal reader unavailable ({}), using journalctl".format(e))
+        return False
+
+# -----------------------------
+# Push wakeup (follower threads -> event loop)
+# -----------------------------
+push_loop = None
+push_event = None
+_push_pending = threading.Event()
+
+def notify_push():
+    """
+    Thread-safe: wake snapshot_producer because new lines are queued.
+    Only the first line of a burst pays for call_soon_threadsafe.
+    """
+    if push_loop is None or push_event is None or _push_pending.is_set():
+        return
+    _push_pending.set()
+    try:
+        push_loop.call_soon_threadsafe(push_event.set)
+    except Exception:
+        pass
+
 # -----------------------------
 # Queues
 # -----------------------------
-m17_q = deque()
-dmr_q = deque()
-p25_q = deque()
-ysf_q = deque()
+class IngestQueue(deque):
+    """Per-unit record queue that counts what went in and what MAX_QUEUE trimmed."""
+    def __init__(self, unit):
+        deque.__init__(self)
+        self.unit = unit
+        self.ingested = 0
+        self.dropped = 0
+
+m17_q = IngestQueue(M17_UNIT)
+dmr_q = IngestQueue(DMR_UNIT)
+p25_q = IngestQueue(P25_UNIT)
+ysf_q = IngestQueue(YSF_UNIT)
 
 followers = []
 
 def build_followers():
     global followers
     followers = []
+    routes = []
     if ENABLE_M17:
-        followers.append(JournalFollower(M17_UNIT, m17_q))
+        routes.append((M17_UNIT, m17_q))
     if ENABLE_DMR:
-        followers.append(JournalFollower(DMR_UNIT, dmr_q))
+        routes.append((DMR_UNIT, dmr_q))
     if ENABLE_P25:
-        followers.append(JournalFollower(P25_UNIT, p25_q))
+        routes.append((P25_UNIT, p25_q))
     if ENABLE_YSF:
-        followers.append(JournalFollower(YSF_UNIT, ysf_q))
+        routes.append((YSF_UNIT, ysf_q))
+    for mode in declarative_modes:
+        routes.append((mode.unit, mode.queue))
+
+    if not routes:
+        return
+
+    if native_journal_available():
+        followers.append(NativeJournalFollower(routes))
+        return
+
+    if JOURNAL_BACKEND == "journalctl":
+        for unit, q in routes:
+            followers.append(JournalFollower(unit, q))
+        return
+
+    if JOURNAL_BACKEND == "native":
+        log_flush("JOURNAL_BACKEND=native but python3-systemd is not usable; falling back to journalctl -o json")
+    followers.append(JsonJournalFollower(routes))
 
 # -----------------------------
-# Syslog line splitter
+# Syslog line splitter (legacy text follower only)
 # HamVOIP can use single-digit days and variable spacing.
 # Example:
 # "Feb  1 22:47:44 HOST prog[pid]: message"
@@ -263,7 +963,6 @@ def split_syslog(line):
 # -----------------------------
 external_talking_now = False
 
-last_heard = []
 MAX_LAST_HEARD = 200
 
 clients_talking = {}  # M17 per callsign
@@ -273,25 +972,80 @@ mmdvm_status = {"version": None, "master": None, "tx_state": "OFF", "last_tx": N
 p25_status = {"last_tx": None, "linked_count": 0, "linked": []}
 ysf_status = {"last_tx": None, "last_event": None}
 
-dmr_talker = {"source":"DMR","callsign":None,"id":None,"module":None,"status":None,"start_time":None,"end_time":None,"last_event_time":None,"extra":{}}
-p25_talker = {"source":"P25","callsign":None,"module":None,"status":None,"start_time":None,"end_time":None,"last_event_time":None,"extra":{}}
-ysf_talker = {"source":"YSF","callsign":None,"module":None,"status":None,"start_time":None,"end_time":None,"last_event_time":None,"extra":{}}
+# *_time fields are display strings, *_epoch fields are float seconds taken
+# from the journal record once at ingest. All comparisons use the epochs.
+dmr_talker = {"source":"DMR","callsign":None,"id":None,"module":None,"status":None,"start_time":None,"end_time":None,"last_event_time":None,"start_epoch":None,"end_epoch":None,"last_event_epoch":None,"extra":{}}
+p25_talker = {"source":"P25","callsign":None,"module":None,"status":None,"start_time":None,"end_time":None,"last_event_time":None,"start_epoch":None,"end_epoch":None,"last_event_epoch":None,"extra":{}}
+ysf_talker = {"source":"YSF","callsign":None,"module":None,"status":None,"start_time":None,"end_time":None,"last_event_time":None,"start_epoch":None,"end_epoch":None,"last_event_epoch":None,"extra":{}}
 
-p25_pending_start = {"active": False, "start_time": None, "who": None}
+p25_pending_start = {"active": False, "start_time": None, "start_epoch": None, "who": None}
 
 asl_rollup_state = {
     "talking": False,
     "start_time": None,
+    "start_epoch": None,
     "last_summary": None,
     "external_triggered": False,
 }
 
 # -----------------------------
-# Last heard push (dedupe)
+# Last heard store
 # -----------------------------
+class LastHeardRing(object):
+    """
+    Fixed-capacity ring of last-heard entries (newest first when read) with
+    a callsign -> most recent epoch index, so dedupe is a dict lookup and
+    inserts never shift a list.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buf = [None] * capacity   # (seq, entry)
+        self._head = 0                  # next slot to write
+        self._size = 0
+        self._seq = 0
+        self._latest = {}               # callsign -> (epoch, seq)
+
+    def __len__(self):
+        return self._size
+
+    def append(self, entry):
+        old = self._buf[self._head]
+        if old is not None:
+            old_cs = old[1].get("callsign")
+            latest = self._latest.get(old_cs)
+            if latest is not None and latest[1] == old[0]:
+                del self._latest[old_cs]
+
+        self._seq += 1
+        self._buf[self._head] = (self._seq, entry)
+        self._head = (self._head + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+        cs = entry.get("callsign")
+        if cs:
+            self._latest[cs] = (entry.get("epoch"), self._seq)
+
+    def last_epoch(self, callsign):
+        latest = self._latest.get(callsign)
+        return latest[0] if latest is not None else None
+
+    def newest(self, limit_n=None):
+        n = self._size if limit_n is None else min(limit_n, self._size)
+        out = []
+        i = self._head
+        for _ in range(n):
+            i = (i - 1) % self.capacity
+            out.append(self._buf[i][1])
+        return out
+
+    def __iter__(self):
+        return iter(self.newest())
+
+last_heard = LastHeardRing(MAX_LAST_HEARD)
+
 def push_last_heard(entry):
     global external_talking_now
-    ts = entry.get("timestamp")
     cs = entry.get("callsign")
     proto = (entry.get("protocol") or "").upper()
 
@@ -301,91 +1055,648 @@ def push_last_heard(entry):
     if cs and proto == "ASL" and external_talking_now and SUPPRESS_ASL_WHEN_EXTERNAL_TALKING:
         return
 
-    new_epoch = parse_syslog_time(ts) if ts else None
+    new_epoch = entry.get("epoch")
     if cs and new_epoch is not None:
-        for e in last_heard[:25]:
-            if e.get("callsign") != cs:
-                continue
-            old_epoch = parse_syslog_time(e.get("timestamp")) if e.get("timestamp") else None
-            if old_epoch is None:
+        old_epoch = last_heard.last_epoch(cs)
+        if old_epoch is not None and abs(new_epoch - old_epoch) <= LAST_HEARD_DEDUP_SECONDS:
+            return
+
+    last_heard.append(entry)
+    if history_store is not None:
+        history_store.record(entry)
+    if activity_stats is not None:
+        activity_stats.record(entry)
+
+# -----------------------------
+# Transmission history (SQLite)
+# -----------------------------
+_target_re = re.compile(r"\b(?:TG|DG-ID)\s*(\d+)", re.IGNORECASE)
+
+def history_target(module):
+    """
+    Indexed talkgroup/module for a last-heard module string: the number for
+    "S2 / TG 91", "TG 10200" or "DG-ID 0", the module itself otherwise.
+    """
+    if not module:
+        return None
+    m = _target_re.search(module)
+    if m:
+        return m.group(1)
+    module = module.strip()
+    if not module or module == "-":
+        return None
+    return module
+
+class HistoryStore(object):
+    """
+    Appends completed transmissions to a local SQLite database in WAL mode.
+    record() is only a queue put; a writer thread batches inserts so the
+    event loop never touches the SD card. Queries use separate read-only
+    connections; the websocket side runs them on query_executor.
+    """
+    def __init__(self, path, retention_days=0, max_rows=0, flush_seconds=2.0):
+        self.path = path
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self.flush_seconds = flush_seconds
+        self._q = queue.Queue()
+        self._thread = None
+        self.written = 0
+        self.last_error = None
+        self.query_executor = ThreadPoolExecutor(max_workers=1)
+        self._readers = threading.local()
+
+    def connect(self):
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        # auto_vacuum only takes effect on a fresh database
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS transmissions ("
+            " id INTEGER PRIMARY KEY,"
+            " epoch REAL NOT NULL,"
+            " start_epoch REAL,"
+            " timestamp TEXT,"
+            " callsign TEXT,"
+            " protocol TEXT,"
+            " module TEXT,"
+            " source TEXT,"
+            " target TEXT)"
+        )
+        # Databases from before history queries: add and backfill target
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(transmissions)")]
+        if "target" not in cols:
+            conn.execute("ALTER TABLE transmissions ADD COLUMN target TEXT")
+            rows = conn.execute("SELECT id, module FROM transmissions").fetchall()
+            conn.executemany("UPDATE transmissions SET target = ? WHERE id = ?",
+                             [(history_target(module), rowid) for rowid, module in rows])
+            log_flush("History: added target column to {} rows".format(len(rows)))
+        conn.execute("CREATE INDEX IF NOT EXISTS transmissions_epoch ON transmissions (epoch)")
+        conn.execute("CREATE INDEX IF NOT EXISTS transmissions_callsign ON transmissions (callsign COLLATE NOCASE, epoch)")
+        conn.execute("CREATE INDEX IF NOT EXISTS transmissions_protocol ON transmissions (protocol, epoch)")
+        conn.execute("CREATE INDEX IF NOT EXISTS transmissions_target ON transmissions (target, epoch)")
+        # Sampled ANALYZE (no-op on old SQLite) so the planner picks the
+        # callsign index over target for combined filters.
+        conn.execute("PRAGMA analysis_limit=1000")
+        if "target" not in cols:
+            conn.execute("ANALYZE")
+        conn.commit()
+        return conn
+
+    def load_recent(self, limit_n):
+        """Newest-first list of last-heard entries."""
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                "SELECT epoch, start_epoch, timestamp, callsign, protocol, module, source"
+                " FROM transmissions ORDER BY epoch DESC, id DESC LIMIT ?",
+                (limit_n,)
+            ).fetchall()
+        finally:
+            conn.close()
+        out = []
+        for epoch, start_epoch, ts, cs, proto, module, source in rows:
+            out.append({"timestamp": ts, "epoch": epoch, "start_epoch": start_epoch, "callsign": cs,
+                        "protocol": proto, "module": module, "source": source})
+        return out
+
+    def query(self, callsign=None, protocol=None, target=None, since=None, until=None, before=None, limit=50):
+        """
+        Newest-first page of transmissions matching every filter given.
+        before is the (epoch, id) cursor returned with the previous page.
+        Returns (rows, next_cursor); next_cursor is None on the last page.
+        Blocking: the websocket side runs it on query_executor.
+        """
+        reader = getattr(self._readers, "conn", None)
+        if reader is None:
+            reader = sqlite3.connect(self.path, timeout=10)
+            reader.execute("PRAGMA query_only=ON")
+            self._readers.conn = reader
+        where = []
+        params = []
+        if callsign:
+            where.append("callsign = ? COLLATE NOCASE")
+            params.append(callsign)
+        if protocol:
+            where.append("protocol = ?")
+            params.append(protocol)
+        if target:
+            where.append("target = ?")
+            params.append(target)
+        if since is not None:
+            where.append("epoch >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("epoch < ?")
+            params.append(until)
+        if before is not None:
+            where.append("(epoch < ? OR (epoch = ? AND id < ?))")
+            params.extend((before[0], before[0], before[1]))
+        sql = ("SELECT id, epoch, start_epoch, timestamp, callsign, protocol, module, source, target"
+               " FROM transmissions")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY epoch DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = reader.execute(sql, params).fetchall()
+
+        out = []
+        for rowid, epoch, start_epoch, ts, cs, proto, module, source, tgt in rows[:limit]:
+            out.append({"epoch": epoch, "start_epoch": start_epoch, "timestamp": ts, "callsign": cs,
+                        "protocol": proto, "module": module, "source": source, "target": tgt})
+        cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            cursor = "{!r}:{}".format(last[1], last[0])
+        return out, cursor
+
+    def start(self):
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        self._thread = t
+        t.start()
+
+    def record(self, entry):
+        self._q.put(entry)
+
+    def pending(self):
+        return self._q.qsize()
+
+    def _prune(self, conn):
+        deleted = 0
+        if self.retention_days and self.retention_days > 0:
+            cutoff = time.time() - self.retention_days * 86400
+            deleted += conn.execute("DELETE FROM transmissions WHERE epoch < ?", (cutoff,)).rowcount
+        if self.max_rows and self.max_rows > 0:
+            deleted += conn.execute(
+                "DELETE FROM transmissions WHERE id <= ("
+                " SELECT id FROM transmissions ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.max_rows,)
+            ).rowcount
+        conn.execute("ANALYZE")
+        conn.commit()
+        if deleted:
+            conn.execute("PRAGMA incremental_vacuum")
+            log_flush("History: pruned {} old rows".format(deleted))
+
+    def _run(self):
+        conn = None
+        last_prune = 0.0
+        while True:
+            try:
+                if conn is None:
+                    conn = self.connect()
+
+                batch = [self._q.get()]
+                # Gather whatever else arrives in the flush window into the
+                # same transaction.
+                deadline = time.time() + self.flush_seconds
+                while True:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._q.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+                rows = []
+                for e in batch:
+                    rows.append((e.get("epoch") or time.time(), e.get("start_epoch"), e.get("timestamp"),
+                                 e.get("callsign"), e.get("protocol"), e.get("module"), e.get("source"),
+                                 history_target(e.get("module"))))
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO transmissions (epoch, start_epoch, timestamp, callsign, protocol, module, source, target)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows
+                    )
+                self.written += len(rows)
+
+                if time.time() - last_prune > 3600:
+                    last_prune = time.time()
+                    self._prune(conn)
+            except Exception as e:
+                self.last_error = str(e)
+                log_flush("History writer error: {}".format(e))
+                try:
+                    if conn is not None:
+                        conn.close()
+                except Exception:
+                    pass
+                conn = None
+                time.sleep(5.0)
+
+history_store = None
+
+def init_history():
+    """Opens the history database and reloads last-heard from it."""
+    global history_store
+    if not ENABLE_HISTORY:
+        return
+    if sqlite3 is None:
+        log_flush("History disabled: sqlite3 module not available")
+        return
+    store = HistoryStore(HISTORY_DB_PATH, HISTORY_RETENTION_DAYS, HISTORY_MAX_ROWS, HISTORY_FLUSH_SECONDS)
+    try:
+        recent = store.load_recent(MAX_LAST_HEARD)
+    except Exception as e:
+        log_flush("History disabled: can't open {} ({})".format(HISTORY_DB_PATH, e))
+        return
+    for entry in reversed(recent):
+        last_heard.append(entry)
+    log_flush("History: reloaded {} last-heard entries from {}".format(len(recent), HISTORY_DB_PATH))
+    store.start()
+    history_store = store
+
+# -----------------------------
+# Activity statistics
+# -----------------------------
+# Fed one completed transmission at a time from push_last_heard. Every
+# tracked key keeps two rings: 60 one-minute buckets (last hour) and 168
+# one-hour buckets (last day / week), each with running totals, so adding
+# and reading cost O(1) amortised; a bucket is cleared once as the window
+# moves past it. Talk time is booked to the bucket the transmission ended in.
+STATS_WINDOWS = ("1h", "24h", "7d")
+# window length plus one bucket of alignment slack
+_STATS_REACH = {"1h": 3600 + 60, "24h": 86400 + 3600, "7d": 604800 + 3600}
+STATS_MAX_TALK_SECONDS = 3600
+
+class RollingCounter(object):
+    """Talk seconds and key-ups in a ring of fixed-width buckets, with running totals."""
+    __slots__ = ("width", "talk", "keyups", "newest", "talk_total", "keyup_total")
+
+    def __init__(self, width, count):
+        self.width = width
+        self.talk = array("d", [0.0]) * count
+        self.keyups = array("H", [0]) * count
+        self.newest = None
+        self.talk_total = 0.0
+        self.keyup_total = 0
+
+    def advance(self, idx):
+        """Move the newest bucket up to idx, clearing the ones that fall out."""
+        n = len(self.talk)
+        if self.newest is None or idx - self.newest >= n:
+            if self.keyup_total:
+                self.talk = array("d", [0.0]) * n
+                self.keyups = array("H", [0]) * n
+                self.talk_total = 0.0
+                self.keyup_total = 0
+            self.newest = idx
+            return
+        for i in range(self.newest + 1, idx + 1):
+            slot = i % n
+            self.talk_total -= self.talk[slot]
+            self.keyup_total -= self.keyups[slot]
+            self.talk[slot] = 0.0
+            self.keyups[slot] = 0
+        if idx > self.newest:
+            self.newest = idx
+
+    def add(self, epoch, seconds):
+        idx = int(epoch // self.width)
+        self.advance(idx)
+        n = len(self.talk)
+        if idx <= self.newest - n:
+            return
+        slot = idx % n
+        self.talk[slot] += seconds
+        self.talk_total += seconds
+        if self.keyups[slot] < 65535:
+            self.keyups[slot] += 1
+            self.keyup_total += 1
+
+    def recent(self, buckets):
+        """(talk, keyups) over the newest `buckets` buckets; advance() first."""
+        n = len(self.talk)
+        if buckets >= n:
+            return max(0.0, self.talk_total), self.keyup_total
+        talk = 0.0
+        keyups = 0
+        for i in range(self.newest - buckets + 1, self.newest + 1):
+            slot = i % n
+            talk += self.talk[slot]
+            keyups += self.keyups[slot]
+        return talk, keyups
+
+    def busiest_hour(self):
+        """Local hour of day (0-23) with the most talk time in the ring, or None."""
+        n = len(self.talk)
+        by_hour = [0.0] * 24
+        for i in range(self.newest - n + 1, self.newest + 1):
+            t = self.talk[i % n]
+            if t:
+                by_hour[time.localtime(i * self.width).tm_hour] += t
+        best = max(range(24), key=lambda h: by_hour[h])
+        return best if by_hour[best] > 0 else None
+
+class ActivityCounters(object):
+    __slots__ = ("minutes", "hours", "last_epoch")
+
+    def __init__(self):
+        self.minutes = RollingCounter(60, 60)
+        self.hours = RollingCounter(3600, 168)
+        self.last_epoch = None
+
+    def add(self, epoch, seconds):
+        self.minutes.add(epoch, seconds)
+        self.hours.add(epoch, seconds)
+        if self.last_epoch is None or epoch > self.last_epoch:
+            self.last_epoch = epoch
+
+    def window(self, name, now):
+        """(talk_seconds, keyups) for "1h", "24h" or "7d" ending at now."""
+        if name == "1h":
+            self.minutes.advance(int(now // 60))
+            return self.minutes.recent(60)
+        self.hours.advance(int(now // 3600))
+        return self.hours.recent(24 if name == "24h" else 168)
+
+class ActivityStats(object):
+    """Per-callsign and per-talkgroup counters, at most max_keys of each."""
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.tables = {"callsign": OrderedDict(), "talkgroup": OrderedDict()}
+        self.total = ActivityCounters()
+        self.evicted = 0
+
+    def _counters(self, by, key):
+        table = self.tables[by]
+        c = table.get(key)
+        if c is None:
+            c = table[key] = ActivityCounters()
+            if len(table) > self.max_keys:
+                table.popitem(last=False)
+                self.evicted += 1
+        else:
+            table.move_to_end(key)
+        return c
+
+    def record(self, entry):
+        """One completed transmission (a last-heard entry)."""
+        epoch = entry.get("epoch")
+        if epoch is None:
+            return
+        start = entry.get("start_epoch")
+        seconds = epoch - start if start is not None else 0.0
+        if not 0 <= seconds <= STATS_MAX_TALK_SECONDS:
+            seconds = 0.0
+        self.total.add(epoch, seconds)
+        cs = (normalize_callsign(entry.get("callsign")) or "").upper()
+        if cs:
+            self._counters("callsign", cs).add(epoch, seconds)
+        target = history_target(entry.get("module"))
+        if target:
+            tg = "{}:{}".format((entry.get("protocol") or "-").upper(), target)
+            self._counters("talkgroup", tg).add(epoch, seconds)
+
+    def _row(self, key, c, window, now, talk, keyups):
+        c.hours.advance(int(now // 3600))
+        return {"key": key, "talk_seconds": round(talk, 1), "keyups": keyups,
+                "busiest_hour": c.hours.busiest_hour(), "last_epoch": c.last_epoch}
+
+    def top(self, by, window, now, limit, sort="talk"):
+        """Top `limit` keys by talk time (or key-ups) in the window."""
+        scored = []
+        oldest = now - _STATS_REACH[window]
+        for key, c in self.tables[by].items():
+            if c.last_epoch < oldest:
                 continue
-            if abs(new_epoch - old_epoch) <= LAST_HEARD_DEDUP_SECONDS:
-                return
+            talk, keyups = c.window(window, now)
+            if keyups:
+                scored.append(((talk, keyups) if sort == "talk" else (keyups, talk), key, c, talk, keyups))
+        best = heapq.nlargest(limit, scored, key=lambda s: s[0])
+        return [self._row(key, c, window, now, talk, keyups) for _, key, c, talk, keyups in best]
+
+    def lookup(self, by, key, window, now):
+        c = self.tables[by].get(key)
+        if c is None:
+            return None
+        talk, keyups = c.window(window, now)
+        return self._row(key, c, window, now, talk, keyups)
+
+    def totals(self, window, now):
+        talk, keyups = self.total.window(window, now)
+        return {"talk_seconds": round(talk, 1), "keyups": keyups}
+
+activity_stats = ActivityStats(STATS_MAX_KEYS) if ENABLE_STATS else None
 
-    last_heard.insert(0, entry)
-    if len(last_heard) > MAX_LAST_HEARD:
-        del last_heard[MAX_LAST_HEARD:]
+# -----------------------------
+# DMR ID database (DMRIds.dat)
+# -----------------------------
+# DMRIds.dat is one "ID CALLSIGN NAME..." line per radio (tab or space
+# separated after dmridupdater.sh). The ID column must lead the line.
+_dmrid_line_re = re.compile(br"^[ \t]*(\d+)[ \t;,]", re.M)
+_dmrid_split_re = re.compile(r"[\t;,]+|\s+")
+_U32 = "I" if array("I").itemsize >= 4 else "L"
+
+class DmrIdIndex(object):
+    """
+    Read-only view of DMRIds.dat. The file stays memory-mapped; the index is
+    two flat arrays (sorted IDs, line offsets) so a 200k-line database costs
+    a couple of MB instead of a dict of strings. Lookups are a bisect plus
+    one line read from the map.
+    """
+    def __init__(self, path):
+        self.path = path
+        f = open(path, "rb")
+        try:
+            st = os.fstat(f.fileno())
+            self.signature = (st.st_ino, st.st_size, st.st_mtime)
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            # the map keeps its own reference to the file
+            f.close()
+        self.ids, self.offsets = self._build()
+
+    def _build(self):
+        ids = array(_U32)
+        offsets = array(_U32)
+        in_order = True
+        prev = -1
+        for m in _dmrid_line_re.finditer(self._mm):
+            v = int(m.group(1))
+            if v < prev:
+                in_order = False
+            prev = v
+            ids.append(v)
+            offsets.append(m.start(1))
+        if not in_order:
+            order = sorted(range(len(ids)), key=ids.__getitem__)
+            ids = array(_U32, (ids[i] for i in order))
+            offsets = array(_U32, (offsets[i] for i in order))
+        return ids, offsets
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, dmr_id):
+        """(callsign, name) for a numeric DMR ID, or None."""
+        try:
+            key = int(dmr_id)
+        except (TypeError, ValueError):
+            return None
+        i = bisect_left(self.ids, key)
+        if i >= len(self.ids) or self.ids[i] != key:
+            return None
+        start = self.offsets[i]
+        end = self._mm.find(b"\n", start)
+        if end < 0:
+            end = len(self._mm)
+        line = self._mm[start:end].decode("utf-8", "replace").strip()
+        fields = _dmrid_split_re.split(line, 2)
+        callsign = normalize_callsign(fields[1]) if len(fields) > 1 else None
+        name = fields[2].strip() if len(fields) > 2 else None
+        return (callsign or None, name or None)
+
+dmr_id_index = None
+
+def resolve_dmr_id(dmr_id):
+    """(callsign, name) from DMRIds.dat, (None, None) when unknown."""
+    idx = dmr_id_index
+    if idx is None or not dmr_id:
+        return (None, None)
+    try:
+        return idx.lookup(dmr_id) or (None, None)
+    except Exception:
+        return (None, None)
+
+def dmrid_watch_loop():
+    """
+    Loads DMRIds.dat and reloads it whenever dmridupdater.sh replaces it.
+    The new index is built here and swapped in with one assignment; parsers
+    holding the old one keep a valid map until they drop it.
+    """
+    global dmr_id_index
+    missing_logged = False
+    while True:
+        try:
+            st = os.stat(DMRID_FILE)
+            sig = (st.st_ino, st.st_size, st.st_mtime)
+            cur = dmr_id_index
+            if cur is None or cur.signature != sig:
+                t0 = time.time()
+                idx = DmrIdIndex(DMRID_FILE)
+                dmr_id_index = idx
+                log_flush("DMR IDs: loaded {} ids from {} in {:.2f}s".format(len(idx), DMRID_FILE, time.time() - t0))
+            missing_logged = False
+        except FileNotFoundError:
+            if not missing_logged:
+                log_flush("DMR IDs: {} not found; numeric IDs won't be resolved".format(DMRID_FILE))
+                missing_logged = True
+        except Exception as e:
+            log_flush("DMR IDs: can't load {} ({})".format(DMRID_FILE, e))
+        time.sleep(DMRID_RELOAD_CHECK_SECONDS)
+
+def start_dmrid_watcher():
+    if not (ENABLE_DMR and DMRID_FILE):
+        return
+    t = threading.Thread(target=dmrid_watch_loop)
+    t.daemon = True
+    t.start()
 
 # -----------------------------
 # Parsers
 # -----------------------------
+# Each mode classifies a message in a single pass: a cheap literal keyword
+# prefilter throws away the (mostly) irrelevant lines, then one combined
+# pattern does the rest. Every alternative is wrapped in an outer named
+# group, so m.lastgroup says which event matched.
+#
+# The individual patterns below are the original sequential implementation.
+# bench_parsers() uses them as the reference to check and time the
+# combined dispatch against.
 open_stream_pattern = re.compile(r"Opening stream on module (\w) for client (\S+)")
 close_stream_pattern = re.compile(r"Closing stream on module (\w)")
 connect_packet_pattern = re.compile(r"Connect packet for module (\w) from (\S+).* at (.*)")
 disconnect_packet_pattern = re.compile(r"Client (\S+)\s+(\w)\s+keepalive timeout")
 droidstar_disconnect_pattern = re.compile(r"Disconnect packet from (\S+)\s+(\w)\s+at (.*)")
 
+# mrefd's patterns are case-sensitive, so its prefilter is too.
+m17_keywords = ("stream on module", "packet", "keepalive timeout")
+m17_event_re = re.compile(
+    r"(?P<open>Opening stream on module (?P<open_module>\w) for client (?P<open_cs>\S+))"
+    r"|(?P<close>Closing stream on module (?P<close_module>\w))"
+    r"|(?P<connect>Connect packet for module (?P<conn_module>\w) from (?P<conn_cs>\S+).* at (?P<conn_ip>.*))"
+    r"|(?P<disconnect>Client (?P<dis_cs>\S+)\s+(?P<dis_module>\w)\s+keepalive timeout)"
+    r"|(?P<droidstar>Disconnect packet from (?P<dd_cs>\S+)\s+(?P<dd_module>\w)\s+at (?P<dd_ip>.*))"
+)
+
+def classify_m17(msg):
+    for k in m17_keywords:
+        if k in msg:
+            return m17_event_re.search(msg)
+    return None
+
 def parse_m17_lines():
     while True:
         try:
-            line = m17_q.popleft()
+            epoch, sys_ts, msg = m17_q.popleft()
         except IndexError:
             break
 
-        sys_ts, _src, msg = split_syslog(line)
-        if not sys_ts or not msg:
+        m = classify_m17(msg)
+        if not m:
             continue
+        kind = m.lastgroup
 
-        om = open_stream_pattern.search(msg)
-        if om:
-            module = om.group(1)
-            cs = normalize_callsign(om.group(2))
-            clients_talking[cs] = {"status":"talking","module":module,"start_time":sys_ts,"end_time":None}
+        if kind == "open":
+            module = m.group("open_module")
+            cs = normalize_callsign(m.group("open_cs"))
+            clients_talking[cs] = {"status":"talking","module":module,"start_time":sys_ts,"end_time":None,"start_epoch":epoch,"end_epoch":None}
+            expiry.cancel(("m17", cs))
             log_flush("M17 START {} {} ({})".format(cs, module, sys_ts))
             continue
 
-        cm = close_stream_pattern.search(msg)
-        if cm:
-            module = cm.group(1)
+        if kind == "close":
+            module = m.group("close_module")
             for cs, info in list(clients_talking.items()):
                 if info.get("status") == "talking" and info.get("module") == module:
                     info["status"] = "not talking"
                     info["end_time"] = sys_ts
+                    info["end_epoch"] = epoch
+                    ref_epoch = epoch or info.get("start_epoch")
+                    if ref_epoch is not None:
+                        expiry.schedule(("m17", cs), ref_epoch + EXPIRE_SECONDS, _expire_m17_client, cs)
                     log_flush("M17 END {} {} ({})".format(cs, module, sys_ts))
-                    push_last_heard({"timestamp":sys_ts,"callsign":cs,"protocol":"M17","module":module,"source":"M17"})
+                    push_last_heard({"timestamp":sys_ts,"epoch":epoch,"start_epoch":info.get("start_epoch"),"callsign":cs,"protocol":"M17","module":module,"source":"M17"})
             continue
 
-        conn = connect_packet_pattern.search(msg)
-        if conn:
-            module = conn.group(1)
-            cs = normalize_callsign(conn.group(2))
-            ip = conn.group(3)
+        if kind == "connect":
+            module = m.group("conn_module")
+            cs = normalize_callsign(m.group("conn_cs"))
+            ip = m.group("conn_ip")
             key = "{}_{}_{}".format(cs, module, ip)
-            peers[key] = {"timestamp":sys_ts,"callsign":cs,"module":module,"ip":ip}
+            peers[key] = {"timestamp":sys_ts,"epoch":epoch,"callsign":cs,"module":module,"ip":ip}
+            if PEER_EXPIRE_SECONDS > 0 and epoch is not None:
+                expiry.schedule(("peer", key), epoch + PEER_EXPIRE_SECONDS, _expire_peer, key)
             continue
 
-        dis = disconnect_packet_pattern.search(msg)
-        if dis:
-            cs = normalize_callsign(dis.group(1))
-            module = dis.group(2)
+        if kind == "disconnect":
+            cs = normalize_callsign(m.group("dis_cs"))
+            module = m.group("dis_module")
             remove = []
             for k, v in peers.items():
                 if v.get("callsign") == cs and v.get("module") == module:
                     remove.append(k)
             for k in remove:
-                peers.pop(k, None)
+                forget_peer(k)
             continue
 
-        dd = droidstar_disconnect_pattern.search(msg)
-        if dd:
-            ip = dd.group(3)
+        if kind == "droidstar":
+            ip = m.group("dd_ip")
             peer_key = None
             for k, v in peers.items():
                 if v.get("ip") == ip:
                     peer_key = k
                     break
             if peer_key:
-                peers.pop(peer_key, None)
+                forget_peer(peer_key)
             continue
 
 # ---- DMR (HamVOIP spacing fix: allow "DMR ," as well as "DMR,") ----
@@ -395,88 +1706,130 @@ dmr_net_header_re  = re.compile(r"\bDMR Slot (\d+), received network voice heade
 dmr_net_end_re     = re.compile(r"\bDMR Slot (\d+), received network end of voice transmission\b", re.IGNORECASE)
 dmr_talker_alias_re = re.compile(r"\bDMR Talker Alias .*?:\s*'([^']+)'\s*$", re.IGNORECASE)
 
+# Same order of precedence as the sequential version. The shared "DMR"
+# literal is factored out so the alternatives are only tried where it
+# occurs. IGNORECASE applies to the whole pattern (Python 3.5 has no scoped
+# flags), which only makes the Begin TX alternative more lenient.
+# The patterns are IGNORECASE, so the prefilter compares lower case.
+dmr_keywords = ("alias", "voice", "tx")
+dmr_event_re = re.compile(
+    r"\bDMR(?:"
+    r"(?P<alias> Talker Alias .*?:\s*'(?P<alias_value>[^']+)'\s*$)"
+    r"|(?P<header> Slot (?P<h_slot>\d+), received network voice header from\s+(?P<h_from>.+?)\s+to TG (?P<h_tg>\d+)\b)"
+    r"|(?P<end> Slot (?P<e_slot>\d+), received network end of voice transmission\b)"
+    r"|(?P<begin>\s*,\s*Begin TX:\s*src=(?P<b_src>\d+)\s+rpt=(?P<b_rpt>\d+)\s+dst=(?P<b_dst>\d+)\s+slot=(?P<b_slot>\d+)\s+cc=(?P<b_cc>\d+)\s+metadata=(?P<b_meta>[^\s]+)\b)"
+    r"|(?P<tx_state>\s*,\s*TX state\s*=\s*(?P<state>ON|OFF)\b))",
+    re.IGNORECASE
+)
+
+def classify_dmr(msg):
+    low = msg.lower()
+    for k in dmr_keywords:
+        if k in low:
+            return dmr_event_re.search(msg)
+    return None
+
 dmr_last_alias = {"value": None, "time": 0.0}
 DMR_ALIAS_WINDOW_SECONDS = 3.0
 
-def _dmr_end(sys_ts):
+def _dmr_end(epoch, sys_ts):
     if dmr_talker.get("callsign") and dmr_talker.get("status") == "talking":
         dmr_talker["status"] = "not talking"
         dmr_talker["end_time"] = sys_ts
         dmr_talker["last_event_time"] = sys_ts
+        dmr_talker["end_epoch"] = epoch
+        dmr_talker["last_event_epoch"] = epoch
         log_flush("DMR END {} {} ({})".format(dmr_talker.get("callsign"), dmr_talker.get("module"), sys_ts))
-        push_last_heard({"timestamp":sys_ts,"callsign":dmr_talker.get("callsign"),"protocol":"DMR","module":dmr_talker.get("module","-"),"source":"DMR"})
+        push_last_heard({"timestamp":sys_ts,"epoch":epoch,"start_epoch":dmr_talker.get("start_epoch"),"callsign":dmr_talker.get("callsign"),"protocol":"DMR","module":dmr_talker.get("module","-"),"source":"DMR"})
 
 def parse_dmr_lines():
     while True:
         try:
-            line = dmr_q.popleft()
+            epoch, sys_ts, msg = dmr_q.popleft()
         except IndexError:
             break
 
-        sys_ts, _src, msg = split_syslog(line)
-        if not sys_ts or not msg:
+        m = classify_dmr(msg)
+        if not m:
             continue
+        kind = m.lastgroup
 
-        ta = dmr_talker_alias_re.search(msg)
-        if ta:
-            alias = normalize_callsign(ta.group(1))
+        if kind == "alias":
+            alias = normalize_callsign(m.group("alias_value"))
             dmr_last_alias["value"] = alias
-            dmr_last_alias["time"] = time.time()
+            dmr_last_alias["time"] = now_epoch()
             if dmr_talker.get("status") == "talking":
                 dmr_talker["callsign"] = alias
                 dmr_talker["last_event_time"] = sys_ts
+                dmr_talker["last_event_epoch"] = epoch
             continue
 
-        nh = dmr_net_header_re.search(msg)
-        if nh:
-            slot = nh.group(1)
-            raw_from = normalize_callsign(nh.group(2))
-            tg = nh.group(3)
+        if kind == "header":
+            slot = m.group("h_slot")
+            raw_from = normalize_callsign(m.group("h_from"))
+            tg = m.group("h_tg")
 
             callsign = raw_from
-            if dmr_last_alias.get("value") and (time.time() - dmr_last_alias.get("time", 0.0)) <= DMR_ALIAS_WINDOW_SECONDS:
+            dmr_id = None
+            name = None
+            if raw_from and raw_from.isdigit():
+                dmr_id = raw_from
+                res_cs, name = resolve_dmr_id(raw_from)
+                callsign = res_cs or raw_from
+            if dmr_last_alias.get("value") and (now_epoch() - dmr_last_alias.get("time", 0.0)) <= DMR_ALIAS_WINDOW_SECONDS:
                 callsign = dmr_last_alias["value"]
 
-            dmr_talker["id"] = None
+            dmr_talker["id"] = dmr_id
             dmr_talker["callsign"] = callsign
+            dmr_talker["extra"] = {"name": name} if name else {}
             dmr_talker["module"] = "S{} / TG {}".format(slot, tg)
             dmr_talker["status"] = "talking"
             dmr_talker["start_time"] = sys_ts
             dmr_talker["end_time"] = None
             dmr_talker["last_event_time"] = sys_ts
+            dmr_talker["start_epoch"] = epoch
+            dmr_talker["end_epoch"] = None
+            dmr_talker["last_event_epoch"] = epoch
             log_flush("DMR NET START {} {} ({})".format(callsign, dmr_talker["module"], sys_ts))
             continue
 
-        ne = dmr_net_end_re.search(msg)
-        if ne:
-            _dmr_end(sys_ts)
+        if kind == "end":
+            _dmr_end(epoch, sys_ts)
             continue
 
-        btx = mmdvm_begin_tx_re.search(msg)
-        if btx:
-            src_id = btx.group(1)
-            dst_tg = btx.group(3)
-            slot = btx.group(4)
-            cc = btx.group(5)
-            meta = normalize_callsign(btx.group(6))
+        if kind == "begin":
+            src_id = m.group("b_src")
+            dst_tg = m.group("b_dst")
+            slot = m.group("b_slot")
+            cc = m.group("b_cc")
+            meta = normalize_callsign(m.group("b_meta"))
+
+            res_cs, name = resolve_dmr_id(src_id)
 
-            mmdvm_status["last_tx"] = {"timestamp":sys_ts,"src":src_id,"dst":dst_tg,"slot":slot,"cc":cc,"metadata":meta}
+            mmdvm_status["last_tx"] = {"timestamp":sys_ts,"epoch":epoch,"src":src_id,"dst":dst_tg,"slot":slot,"cc":cc,"metadata":meta,
+                                       "callsign":res_cs,"name":name}
 
             dmr_talker["id"] = src_id
-            dmr_talker["callsign"] = meta or src_id or "-"
+            if meta and not meta.isdigit():
+                dmr_talker["callsign"] = meta
+            else:
+                dmr_talker["callsign"] = res_cs or meta or src_id or "-"
+            dmr_talker["extra"] = {"name": name} if name else {}
             dmr_talker["module"] = "S{} / TG {}".format(slot, dst_tg)
             dmr_talker["status"] = "talking"
             dmr_talker["start_time"] = sys_ts
             dmr_talker["end_time"] = None
             dmr_talker["last_event_time"] = sys_ts
+            dmr_talker["start_epoch"] = epoch
+            dmr_talker["end_epoch"] = None
+            dmr_talker["last_event_epoch"] = epoch
             continue
 
-        st = mmdvm_tx_state_re.search(msg)
-        if st:
-            state = st.group(1).upper()
+        if kind == "tx_state":
+            state = m.group("state").upper()
             mmdvm_status["tx_state"] = state
             if state == "OFF":
-                _dmr_end(sys_ts)
+                _dmr_end(epoch, sys_ts)
             continue
 
 # ---- P25 ----
@@ -485,47 +1838,60 @@ p25_tx_started_re = re.compile(r"^Transmission started from\s+(\S+)\s*$")
 p25_tx_from_re    = re.compile(r"^Transmission from\s+(\d+)\s+at\s+(.+?)\s+to\s+TG\s+(\d+)\s*$")
 p25_tx_end_re     = re.compile(r"^Received end of transmission\s*$")
 
-def _p25_end(sys_ts):
+p25_event_re = re.compile(
+    r"^(?:(?P<started>Transmission started from\s+(?P<started_who>\S+)\s*)"
+    r"|(?P<tx_from>Transmission from\s+(?P<rid>\d+)\s+at\s+(?P<at>.+?)\s+to\s+TG\s+(?P<tg>\d+)\s*)"
+    r"|(?P<tx_end>Received end of transmission\s*))$"
+)
+
+def classify_p25(msg):
+    # P25Reflector lines look like "M: 2026-02-01 22:14:00.164 <payload>"
+    if not msg.startswith("M:") or "ransmission" not in msg:
+        return None
+    mm = p25_m_prefix_re.match(msg)
+    if not mm:
+        return None
+    return p25_event_re.match(mm.group(1).strip())
+
+def _p25_end(epoch, sys_ts):
     if p25_talker.get("callsign") and p25_talker.get("status") == "talking":
         p25_talker["status"] = "not talking"
         p25_talker["end_time"] = sys_ts
         p25_talker["last_event_time"] = sys_ts
-        push_last_heard({"timestamp":sys_ts,"callsign":p25_talker.get("callsign"),"protocol":"P25","module":p25_talker.get("module","-"),"source":"P25"})
+        p25_talker["end_epoch"] = epoch
+        p25_talker["last_event_epoch"] = epoch
+        push_last_heard({"timestamp":sys_ts,"epoch":epoch,"start_epoch":p25_talker.get("start_epoch"),"callsign":p25_talker.get("callsign"),"protocol":"P25","module":p25_talker.get("module","-"),"source":"P25"})
     p25_pending_start["active"] = False
     p25_pending_start["start_time"] = None
+    p25_pending_start["start_epoch"] = None
     p25_pending_start["who"] = None
 
 def parse_p25_lines():
     while True:
         try:
-            line = p25_q.popleft()
+            epoch, sys_ts, msg = p25_q.popleft()
         except IndexError:
             break
 
-        sys_ts, _src, msg = split_syslog(line)
-        if not sys_ts or not msg:
+        m = classify_p25(msg)
+        if not m:
             continue
+        kind = m.lastgroup
 
-        mm = p25_m_prefix_re.match(msg)
-        if not mm:
-            continue
-        payload = mm.group(1).strip()
-
-        ts0 = p25_tx_started_re.match(payload)
-        if ts0:
-            who = normalize_callsign(ts0.group(1))
+        if kind == "started":
+            who = normalize_callsign(m.group("started_who"))
             p25_pending_start["active"] = True
             p25_pending_start["start_time"] = sys_ts
+            p25_pending_start["start_epoch"] = epoch
             p25_pending_start["who"] = who
             continue
 
-        tx = p25_tx_from_re.match(payload)
-        if tx:
-            rid = tx.group(1)
-            at = normalize_callsign(tx.group(2).strip())
-            tg = tx.group(3)
+        if kind == "tx_from":
+            rid = m.group("rid")
+            at = normalize_callsign(m.group("at").strip())
+            tg = m.group("tg")
 
-            p25_status["last_tx"] = {"timestamp":sys_ts,"rid":rid,"at":at,"tg":tg}
+            p25_status["last_tx"] = {"timestamp":sys_ts,"epoch":epoch,"rid":rid,"at":at,"tg":tg}
 
             p25_talker["callsign"] = at
             p25_talker["module"] = "TG {}".format(tg)
@@ -533,62 +1899,237 @@ def parse_p25_lines():
 
             if p25_pending_start["active"] and p25_pending_start["start_time"]:
                 p25_talker["start_time"] = p25_pending_start["start_time"]
-            else:
-                p25_talker["start_time"] = p25_talker.get("start_time") or sys_ts
+                p25_talker["start_epoch"] = p25_pending_start["start_epoch"]
+            elif not p25_talker.get("start_time"):
+                p25_talker["start_time"] = sys_ts
+                p25_talker["start_epoch"] = epoch
 
             p25_talker["end_time"] = None
             p25_talker["last_event_time"] = sys_ts
+            p25_talker["end_epoch"] = None
+            p25_talker["last_event_epoch"] = epoch
 
             p25_pending_start["active"] = False
             p25_pending_start["start_time"] = None
+            p25_pending_start["start_epoch"] = None
             p25_pending_start["who"] = None
             continue
 
-        if p25_tx_end_re.match(payload):
-            _p25_end(sys_ts)
+        if kind == "tx_end":
+            _p25_end(epoch, sys_ts)
             continue
 
 # ---- YSF ----
 ysf_net_data_re = re.compile(r"\bYSF,\s+received network data from\s+(.+?)\s+to\s+(.+?)\s+at\s+(.+?)\s*$", re.IGNORECASE)
 ysf_net_end_re  = re.compile(r"\bYSF,\s+received network end of transmission,\s+([0-9.]+)\s+seconds\b", re.IGNORECASE)
 
-def _ysf_end(sys_ts):
+ysf_keywords = ("received network",)
+ysf_event_re = re.compile(
+    r"\bYSF,\s+received network (?:"
+    r"(?P<data>data from\s+(?P<from>.+?)\s+to\s+(?P<to>.+?)\s+at\s+(?P<at>.+?)\s*$)"
+    r"|(?P<end>end of transmission,\s+(?P<secs>[0-9.]+)\s+seconds\b))",
+    re.IGNORECASE
+)
+
+def classify_ysf(msg):
+    low = msg.lower()
+    for k in ysf_keywords:
+        if k in low:
+            return ysf_event_re.search(msg)
+    return None
+
+def _ysf_end(epoch, sys_ts):
     if ysf_talker.get("callsign") and ysf_talker.get("status") == "talking":
         ysf_talker["status"] = "not talking"
         ysf_talker["end_time"] = sys_ts
         ysf_talker["last_event_time"] = sys_ts
-        push_last_heard({"timestamp":sys_ts,"callsign":ysf_talker.get("callsign"),"protocol":"YSF","module":ysf_talker.get("module","-"),"source":"YSF"})
+        ysf_talker["end_epoch"] = epoch
+        ysf_talker["last_event_epoch"] = epoch
+        push_last_heard({"timestamp":sys_ts,"epoch":epoch,"start_epoch":ysf_talker.get("start_epoch"),"callsign":ysf_talker.get("callsign"),"protocol":"YSF","module":ysf_talker.get("module","-"),"source":"YSF"})
 
 def parse_ysf_lines():
     while True:
         try:
-            line = ysf_q.popleft()
+            epoch, sys_ts, msg = ysf_q.popleft()
         except IndexError:
             break
 
-        sys_ts, _src, msg = split_syslog(line)
-        if not sys_ts or not msg:
+        m = classify_ysf(msg)
+        if not m:
             continue
+        kind = m.lastgroup
 
-        nd = ysf_net_data_re.search(msg)
-        if nd:
-            raw_from = normalize_callsign(nd.group(1))
-            raw_to   = normalize_callsign(nd.group(2))
-            raw_at   = normalize_callsign(nd.group(3))
+        if kind == "data":
+            raw_from = normalize_callsign(m.group("from"))
+            raw_to = normalize_callsign(m.group("to"))
+            raw_at = normalize_callsign(m.group("at"))
 
-            ysf_status["last_tx"] = {"timestamp":sys_ts,"callsign":raw_from,"dgid":raw_to,"note":"at {}".format(raw_at)}
+            ysf_status["last_tx"] = {"timestamp":sys_ts,"epoch":epoch,"callsign":raw_from,"dgid":raw_to,"note":"at {}".format(raw_at)}
             ysf_talker["callsign"] = raw_from
             ysf_talker["module"] = raw_to
             ysf_talker["status"] = "talking"
             ysf_talker["start_time"] = sys_ts
             ysf_talker["end_time"] = None
             ysf_talker["last_event_time"] = sys_ts
+            ysf_talker["start_epoch"] = epoch
+            ysf_talker["end_epoch"] = None
+            ysf_talker["last_event_epoch"] = epoch
+            continue
+
+        if kind == "end":
+            _ysf_end(epoch, sys_ts)
             continue
 
-        ne = ysf_net_end_re.search(msg)
-        if ne:
-            _ysf_end(sys_ts)
+# -----------------------------
+# Declarative modes (MODE_DEFINITIONS)
+# -----------------------------
+_named_group_re = re.compile(r"\(\?P<([A-Za-z_][A-Za-z0-9_]*)>")
+
+class _Fields(dict):
+    def __missing__(self, key):
+        return "-"
+
+def _render(template, fields):
+    try:
+        return template.format_map(fields)
+    except Exception:
+        return "-"
+
+def new_talker(source):
+    return {"source":source,"callsign":None,"module":None,"status":None,"start_time":None,"end_time":None,"last_event_time":None,"start_epoch":None,"end_epoch":None,"last_event_epoch":None,"extra":{}}
+
+class DeclarativeMode(object):
+    """
+    One compiled MODE_DEFINITIONS entry: its queue, talker, optional status
+    section and a single combined pattern for all of its events.
+    """
+    def __init__(self, defn):
+        self.name = defn["name"]
+        self.key = self.name.lower()
+        self.unit = defn["unit"]
+        self.status_key = defn.get("status")
+        # event_re is IGNORECASE; so is the prefilter
+        self.keywords = tuple(k.lower() for k in defn.get("keywords") or ())
+        self.talker_map = defn.get("talker") or {}
+        self.last_tx_map = defn.get("last_tx") or {}
+        self.queue = IngestQueue(self.unit)
+        self.talker = new_talker(self.name)
+        self.status = {"last_tx": None} if self.status_key else None
+
+        # Each event becomes (?P<e{i}>...) with its own groups renamed to
+        # e{i}_{name}, so one search tells us which event matched.
+        self.kinds = []
+        parts = []
+        for i, (kind, pattern) in enumerate(defn["events"]):
+            if kind not in ("start", "end", "alias"):
+                raise ValueError("{}: unknown event kind {!r}".format(self.name, kind))
+            inner = _named_group_re.sub(lambda m, i=i: "(?P<e{}_{}>".format(i, m.group(1)), pattern)
+            parts.append("(?P<e{}>{})".format(i, inner))
+            self.kinds.append(kind)
+        self.event_re = re.compile("|".join(parts), re.IGNORECASE)
+
+    def classify(self, msg):
+        """(kind, fields) or None."""
+        if self.keywords:
+            low = msg.lower()
+            for k in self.keywords:
+                if k in low:
+                    break
+            else:
+                return None
+        m = self.event_re.search(msg)
+        if not m:
+            return None
+        i = int(m.lastgroup[1:].split("_", 1)[0])
+        prefix = "e{}_".format(i)
+        fields = _Fields()
+        for name, value in m.groupdict().items():
+            if value is not None and name.startswith(prefix):
+                fields[name[len(prefix):]] = value.strip()
+        return self.kinds[i], fields
+
+    def parse(self):
+        while True:
+            try:
+                epoch, sys_ts, msg = self.queue.popleft()
+            except IndexError:
+                break
+
+            hit = self.classify(msg)
+            if not hit:
+                continue
+            kind, fields = hit
+            if kind == "start":
+                self._start(epoch, sys_ts, fields)
+            elif kind == "end":
+                self._end(epoch, sys_ts)
+            elif kind == "alias":
+                callsign = normalize_callsign(_render(self.talker_map.get("callsign", "{callsign}"), fields))
+                if callsign and callsign != "-" and self.talker.get("status") == "talking":
+                    self.talker["callsign"] = callsign
+                    self.talker["last_event_time"] = sys_ts
+                    self.talker["last_event_epoch"] = epoch
+
+    def _start(self, epoch, sys_ts, fields):
+        t = self.talker
+        callsign = normalize_callsign(_render(self.talker_map.get("callsign", "{callsign}"), fields))
+        if not callsign or callsign == "-":
+            return
+        module = _render(self.talker_map.get("module", "-"), fields)
+
+        if self.status is not None:
+            last_tx = {"timestamp": sys_ts, "epoch": epoch}
+            for k, template in self.last_tx_map.items():
+                last_tx[k] = _render(template, fields)
+            self.status["last_tx"] = last_tx
+
+        if t.get("status") == "talking":
+            if t.get("callsign") == callsign and t.get("module") == module:
+                # repeated header for the same transmission
+                t["last_event_time"] = sys_ts
+                t["last_event_epoch"] = epoch
+                return
+            self._end(epoch, sys_ts)
+
+        t["callsign"] = callsign
+        t["module"] = module
+        t["status"] = "talking"
+        t["start_time"] = sys_ts
+        t["end_time"] = None
+        t["last_event_time"] = sys_ts
+        t["start_epoch"] = epoch
+        t["end_epoch"] = None
+        t["last_event_epoch"] = epoch
+        log_flush("{} START {} {} ({})".format(self.name, callsign, module, sys_ts))
+
+    def _end(self, epoch, sys_ts):
+        t = self.talker
+        if t.get("callsign") and t.get("status") == "talking":
+            t["status"] = "not talking"
+            t["end_time"] = sys_ts
+            t["last_event_time"] = sys_ts
+            t["end_epoch"] = epoch
+            t["last_event_epoch"] = epoch
+            log_flush("{} END {} ({})".format(self.name, t.get("callsign"), sys_ts))
+            push_last_heard({"timestamp":sys_ts,"epoch":epoch,"start_epoch":t.get("start_epoch"),"callsign":t.get("callsign"),"protocol":self.name,"module":t.get("module") or "-","source":self.name})
+
+declarative_modes = []
+
+def load_modes():
+    """Compiles the enabled MODE_DEFINITIONS entries."""
+    global declarative_modes, STATUS_SECTIONS
+    loaded = []
+    for defn in MODE_DEFINITIONS:
+        if not defn.get("enabled", True):
             continue
+        try:
+            loaded.append(DeclarativeMode(defn))
+        except Exception as e:
+            log_flush("Mode {} not loaded: {}".format(defn.get("name"), e))
+    declarative_modes = loaded
+    STATUS_SECTIONS = BUILTIN_STATUS_SECTIONS + tuple(m.status_key for m in loaded if m.status_key)
+    if loaded:
+        log_flush("Declarative modes: {}".format(", ".join("{} ({})".format(m.name, m.unit) for m in loaded)))
 
 # -----------------------------
 # External talker check
@@ -611,6 +2152,11 @@ def any_external_talker_active():
         if ysf_talker.get("status") == "talking" and ysf_talker.get("callsign") and (not is_local_origin(ysf_talker.get("callsign"))):
             return True
 
+    for mode in declarative_modes:
+        t = mode.talker
+        if t.get("status") == "talking" and t.get("callsign") and (not is_local_origin(t.get("callsign"))):
+            return True
+
     return False
 
 # -----------------------------
@@ -619,7 +2165,7 @@ def any_external_talker_active():
 def build_combined_clients_talking():
     global asl_rollup_state
     combined = []
-    now = time.time()
+    now = now_epoch()
 
     external_talking = any_external_talker_active()
 
@@ -631,24 +2177,17 @@ def build_combined_clients_talking():
         status = info.get("status", "-")
         module = info.get("module", "-")
         start_ts = info.get("start_time")
-        end_ts = info.get("end_time")
+        start_epoch = info.get("start_epoch")
 
         if status != "talking":
-            ref_ts = end_ts or start_ts
-            ref_epoch = parse_syslog_time(ref_ts) if ref_ts else None
-            if ref_epoch is not None and (now - ref_epoch) > EXPIRE_SECONDS:
-                try:
-                    del clients_talking[callsign]
-                except Exception:
-                    pass
             continue
 
         cs = normalize_callsign(callsign)
 
         if cs and is_local_origin(cs):
             bridged_parts.append("M17:{}".format(module))
-            if start_ts:
-                bridged_start_candidates.append(start_ts)
+            if start_epoch is not None:
+                bridged_start_candidates.append((start_epoch, start_ts))
             continue
 
         combined.append({
@@ -658,44 +2197,55 @@ def build_combined_clients_talking():
             "status": "talking",
             "start_time": start_ts or "-",
             "end_time": "-",
+            "start_epoch": start_epoch,
+            "end_epoch": None,
         })
 
     # DMR
-    expire_talker(dmr_talker, EXPIRE_SECONDS)
     if dmr_talker.get("callsign") and dmr_talker.get("status") == "talking":
         cs = normalize_callsign(dmr_talker.get("callsign"))
         mod = dmr_talker.get("module") or "-"
         if cs and is_local_origin(cs):
             bridged_parts.append("DMR:{}".format(mod.replace(" ", "")))
-            if dmr_talker.get("start_time"):
-                bridged_start_candidates.append(dmr_talker.get("start_time"))
+            if dmr_talker.get("start_epoch") is not None:
+                bridged_start_candidates.append((dmr_talker.get("start_epoch"), dmr_talker.get("start_time")))
         else:
-            combined.append({"source":"DMR","callsign":cs,"module":mod,"status":"talking","start_time":dmr_talker.get("start_time") or "-","end_time":"-"})
+            combined.append({"source":"DMR","callsign":cs,"name":(dmr_talker.get("extra") or {}).get("name"),"module":mod,"status":"talking","start_time":dmr_talker.get("start_time") or "-","end_time":"-","start_epoch":dmr_talker.get("start_epoch"),"end_epoch":None})
 
     # P25
-    expire_talker(p25_talker, EXPIRE_SECONDS)
     if p25_talker.get("callsign") and p25_talker.get("status") == "talking":
         cs = normalize_callsign(p25_talker.get("callsign"))
         mod = p25_talker.get("module") or "-"
         if cs and is_local_origin(cs):
             if mod.strip() and mod.strip() != "-":
                 bridged_parts.append("P25:{}".format(mod.replace(" ", "")))
-                if p25_talker.get("start_time"):
-                    bridged_start_candidates.append(p25_talker.get("start_time"))
+                if p25_talker.get("start_epoch") is not None:
+                    bridged_start_candidates.append((p25_talker.get("start_epoch"), p25_talker.get("start_time")))
         else:
-            combined.append({"source":"P25","callsign":cs,"module":mod,"status":"talking","start_time":p25_talker.get("start_time") or "-","end_time":"-"})
+            combined.append({"source":"P25","callsign":cs,"module":mod,"status":"talking","start_time":p25_talker.get("start_time") or "-","end_time":"-","start_epoch":p25_talker.get("start_epoch"),"end_epoch":None})
 
     # YSF
-    expire_talker(ysf_talker, EXPIRE_SECONDS)
     if ysf_talker.get("callsign") and ysf_talker.get("status") == "talking":
         cs = normalize_callsign(ysf_talker.get("callsign"))
         mod = ysf_talker.get("module") or "-"
         if cs and is_local_origin(cs):
             bridged_parts.append("YSF:{}".format(mod.replace(" ", "")))
-            if ysf_talker.get("start_time"):
-                bridged_start_candidates.append(ysf_talker.get("start_time"))
+            if ysf_talker.get("start_epoch") is not None:
+                bridged_start_candidates.append((ysf_talker.get("start_epoch"), ysf_talker.get("start_time")))
         else:
-            combined.append({"source":"YSF","callsign":cs,"module":mod,"status":"talking","start_time":ysf_talker.get("start_time") or "-","end_time":"-"})
+            combined.append({"source":"YSF","callsign":cs,"module":mod,"status":"talking","start_time":ysf_talker.get("start_time") or "-","end_time":"-","start_epoch":ysf_talker.get("start_epoch"),"end_epoch":None})
+
+    for mode in declarative_modes:
+        t = mode.talker
+        if t.get("callsign") and t.get("status") == "talking":
+            cs = normalize_callsign(t.get("callsign"))
+            mod = t.get("module") or "-"
+            if cs and is_local_origin(cs):
+                bridged_parts.append("{}:{}".format(mode.name, mod.replace(" ", "")))
+                if t.get("start_epoch") is not None:
+                    bridged_start_candidates.append((t.get("start_epoch"), t.get("start_time")))
+            else:
+                combined.append({"source":mode.name,"callsign":cs,"module":mod,"status":"talking","start_time":t.get("start_time") or "-","end_time":"-","start_epoch":t.get("start_epoch"),"end_epoch":None})
 
     if bridged_parts:
         dedup = []
@@ -712,23 +2262,29 @@ def build_combined_clients_talking():
         if not asl_rollup_state.get("external_triggered"):
             ended_ts = now_syslog_ts()
             summary = asl_rollup_state.get("last_summary") or "-"
-            push_last_heard({"timestamp": ended_ts, "callsign": ASL_LABEL_CALL, "protocol": "ASL", "module": summary, "source": ASL_LABEL_SOURCE})
+            push_last_heard({"timestamp": ended_ts, "epoch": now, "start_epoch": asl_rollup_state.get("start_epoch"), "callsign": ASL_LABEL_CALL, "protocol": "ASL", "module": summary, "source": ASL_LABEL_SOURCE})
         asl_rollup_state["talking"] = False
         asl_rollup_state["start_time"] = None
+        asl_rollup_state["start_epoch"] = None
         asl_rollup_state["last_summary"] = None
         asl_rollup_state["external_triggered"] = False
 
     if asl_is_talking:
         summary = " | ".join(bridged_parts) if bridged_parts else "-"
-        start_time = min(bridged_start_candidates) if bridged_start_candidates else now_syslog_ts()
+        # Earliest start by epoch, not by comparing display strings
+        if bridged_start_candidates:
+            start_epoch, start_time = min(bridged_start_candidates)
+        else:
+            start_epoch, start_time = now, now_syslog_ts()
 
         if not asl_rollup_state.get("talking"):
             asl_rollup_state["talking"] = True
             asl_rollup_state["start_time"] = start_time
+            asl_rollup_state["start_epoch"] = start_epoch
             asl_rollup_state["external_triggered"] = False
         asl_rollup_state["last_summary"] = summary
 
-        combined.insert(0, {"source": ASL_LABEL_SOURCE, "callsign": ASL_LABEL_CALL, "module": summary, "status": "talking", "start_time": asl_rollup_state.get("start_time") or start_time, "end_time": "-"})
+        combined.insert(0, {"source": ASL_LABEL_SOURCE, "callsign": ASL_LABEL_CALL, "module": summary, "status": "talking", "start_time": asl_rollup_state.get("start_time") or start_time, "end_time": "-", "start_epoch": asl_rollup_state.get("start_epoch") or start_epoch, "end_epoch": None})
 
     elif asl_rollup_state.get("talking") is False and external_talking and (len(bridged_parts) >= ASL_MIN_MODES_FOR_ROLLUP):
         asl_rollup_state["talking"] = True
@@ -737,17 +2293,17 @@ def build_combined_clients_talking():
 
     return combined
 
+def last_heard_row(e):
+    return {"source": e.get("source", e.get("protocol","-")), "callsign": e.get("callsign","-"), "protocol": e.get("protocol","-"), "module_or_tg": e.get("module","-"), "timestamp": e.get("timestamp","-"), "epoch": e.get("epoch")}
+
 def build_combined_last_heard(limit_n):
-    out = []
-    for e in last_heard[:limit_n]:
-        out.append({"source": e.get("source", e.get("protocol","-")), "callsign": e.get("callsign","-"), "protocol": e.get("protocol","-"), "module_or_tg": e.get("module","-"), "timestamp": e.get("timestamp","-")})
-    return out
+    return [last_heard_row(e) for e in last_heard.newest(limit_n)]
 
 def build_combined_peers(limit_n):
     out = []
     vals = list(peers.values())
     for p in vals[:limit_n]:
-        out.append({"source":"M17","callsign":p.get("callsign","-"),"module":p.get("module","-"),"ip_or_master":p.get("ip","-"),"timestamp":p.get("timestamp","-")})
+        out.append({"source":"M17","callsign":p.get("callsign","-"),"module":p.get("module","-"),"ip_or_master":p.get("ip","-"),"timestamp":p.get("timestamp","-"),"epoch":p.get("epoch")})
     return out
 
 def parse_journal_queues():
@@ -760,46 +2316,2151 @@ def parse_journal_queues():
         parse_p25_lines()
     if ENABLE_YSF:
         parse_ysf_lines()
+    for mode in declarative_modes:
+        mode.parse()
+    if ENABLE_DMR:
+        schedule_talker_expiry(dmr_talker)
+    if ENABLE_P25:
+        schedule_talker_expiry(p25_talker)
+    if ENABLE_YSF:
+        schedule_talker_expiry(ysf_talker)
+    for mode in declarative_modes:
+        schedule_talker_expiry(mode.talker)
     external_talking_now = any_external_talker_active()
 
 # -----------------------------
 # TLS (Python 3.5 compatible)
 # -----------------------------
-ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-ssl_context.load_cert_chain(certfile=fullchain_cert, keyfile=private_key)
+# Loaded when the server first listens, so --bench-parsers, --replay and the
+# fan-out ingestion process run without the certificate.
+ssl_context = None
+
+def server_ssl_context():
+    global ssl_context
+    if ssl_context is None:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+        ctx.load_cert_chain(certfile=fullchain_cert, keyfile=private_key)
+        ssl_context = ctx
+    return ssl_context
+
+# -----------------------------
+# Snapshot producer / broadcaster
+# -----------------------------
+# One producer builds and encodes the payload once per tick, then fans the
+# same frame out to every connected socket. Per-tick cost stays flat no
+# matter how many browsers are open.
+connected_clients = set()
+latest_data = None
+latest_frame = None
+latest_frames = {}      # latest_data per encoding (latest_frame is the json one)
+latest_state = None
+latest_delta = None
+state_version = 0
+
+def build_snapshot():
+    if hub_nodes:
+        return build_hub_snapshot()
+    t0 = time.perf_counter()
+    parse_journal_queues()
+    expiry.run(now_epoch())
+    metric_parse_seconds.observe(time.perf_counter() - t0)
+
+    combined_obj = {
+        "clients_talking": build_combined_clients_talking(),
+        "last_heard": build_combined_last_heard(10),
+        "peers": build_combined_peers(10) if ENABLE_M17 else [],
+    }
+
+    data = {
+        "uptime_seconds": get_uptime_seconds(),
+        "combined": combined_obj,
+    }
+
+    # Shallow copies so the previous snapshot can be compared against
+    # the live dicts the parsers keep mutating.
+    if ENABLE_DMR:
+        data["mmdvm"] = dict(mmdvm_status)
+    if ENABLE_P25:
+        data["p25"] = dict(p25_status)
+    if ENABLE_YSF:
+        data["ysf"] = dict(ysf_status)
+    for mode in declarative_modes:
+        if mode.status is not None:
+            data[mode.status_key] = dict(mode.status)
+
+    return data
+
+def note_snapshot(data):
+    """
+    Bumps state_version when anything but uptime differs from the last
+    snapshot and records the row-level delta for delta clients.
+    Returns True if it changed.
+    """
+    global latest_state, latest_delta, state_version
+    state = dict(data)
+    state.pop("uptime_seconds", None)
+    if state == latest_state:
+        return False
+    latest_delta = diff_states(latest_state, state)
+    latest_state = state
+    state_version += 1
+    return True
+
+# -----------------------------
+# Delta protocol (opt-in: ws://host:port/?proto=delta)
+# -----------------------------
+# Old clients keep getting the full payload every tick. Delta clients get:
+#   {"type":"snapshot","seq":N, ...full payload, every row carries "key"}
+#   {"type":"delta","seq":N,"combined":{section:{"added":[rows],"updated":[rows],
+#       "removed":[keys],"order":[keys]}}, "mmdvm"/"p25"/"ysf": only if changed}
+#   {"type":"heartbeat","seq":N} when nothing changed
+# seq is state_version, so it goes up by exactly one per delta. A client that
+# sees a gap sends {"type":"resync"} and gets a fresh snapshot.
+DELTA_SECTIONS = ("clients_talking", "last_heard", "peers")
+BUILTIN_STATUS_SECTIONS = ("mmdvm", "p25", "ysf")
+# plus the status keys of the loaded declarative modes (load_modes)
+STATUS_SECTIONS = BUILTIN_STATUS_SECTIONS
+
+def row_key(section, row):
+    if section == "clients_talking":
+        return "{}|{}".format(row.get("source"), row.get("callsign"))
+    if section == "last_heard":
+        return "{}|{}|{}|{}".format(row.get("timestamp"), row.get("callsign"), row.get("protocol"), row.get("module_or_tg"))
+    return "{}|{}|{}".format(row.get("callsign"), row.get("module"), row.get("ip_or_master"))
+
+def section_keys(section, rows):
+    # Keys must be unique within a section; suffix the rare duplicate.
+    keys = []
+    seen = set()
+    for r in rows:
+        k = row_key(section, r)
+        if k in seen:
+            n = 2
+            while "{}#{}".format(k, n) in seen:
+                n += 1
+            k = "{}#{}".format(k, n)
+        seen.add(k)
+        keys.append(k)
+    return keys
+
+def keyed_rows(section, rows):
+    out = []
+    for k, r in zip(section_keys(section, rows), rows):
+        kr = dict(r)
+        kr["key"] = k
+        out.append(kr)
+    return out
+
+def diff_states(old_state, new_state):
+    old_state = old_state or {}
+    old_combined = old_state.get("combined") or {}
+    new_combined = new_state.get("combined") or {}
+    out = {"combined": {}}
+
+    for section in DELTA_SECTIONS:
+        old_rows = old_combined.get(section) or []
+        new_rows = new_combined.get(section) or []
+        if old_rows == new_rows:
+            continue
+        old_map = dict(zip(section_keys(section, old_rows), old_rows))
+        new_keys = section_keys(section, new_rows)
+        added = []
+        updated = []
+        for k, r in zip(new_keys, new_rows):
+            kr = dict(r)
+            kr["key"] = k
+            if k not in old_map:
+                added.append(kr)
+            elif old_map[k] != r:
+                updated.append(kr)
+        new_key_set = set(new_keys)
+        removed = [k for k in old_map if k not in new_key_set]
+        out["combined"][section] = {"added": added, "updated": updated, "removed": removed, "order": new_keys}
+
+    for name in STATUS_SECTIONS:
+        if new_state.get(name) != old_state.get(name):
+            out[name] = new_state.get(name)
+
+    return out
+
+def snapshot_message(state, seq):
+    msg = {"type": "snapshot", "seq": seq, "uptime_seconds": get_uptime_seconds()}
+    combined = state.get("combined") or {}
+    msg["combined"] = dict((section, keyed_rows(section, combined[section])) for section in DELTA_SECTIONS if section in combined)
+    for name in STATUS_SECTIONS:
+        if name in state:
+            msg[name] = state[name]
+    return msg
+
+_delta_snapshot_cache = {"seq": None, "frames": {}}
+
+def encode_delta_snapshot(encoding="json"):
+    """Full snapshot frame for delta clients, encoded once per state_version and encoding."""
+    if _delta_snapshot_cache["seq"] == state_version and encoding in _delta_snapshot_cache["frames"]:
+        return _delta_snapshot_cache["frames"][encoding]
+    frame = encode_frame(snapshot_message(latest_state or {}, state_version), encoding)
+    if _delta_snapshot_cache["seq"] != state_version:
+        _delta_snapshot_cache["seq"] = state_version
+        _delta_snapshot_cache["frames"] = {}
+    _delta_snapshot_cache["frames"][encoding] = frame
+    return frame
+
+# -----------------------------
+# Frame encodings
+# -----------------------------
+# Clients get JSON text frames unless they ask for MessagePack binary frames
+# with ?enc=msgpack or the "digidash.msgpack" subprotocol. Each frame is
+# encoded once per encoding in use, and per-encoding counts, bytes and
+# encode time are kept for /metrics.
+SUBPROTOCOLS = ("digidash.json", "digidash.msgpack")
+
+def _mp(obj, out):
+    if obj is None:
+        out.append(b"\xc0")
+    elif obj is True:
+        out.append(b"\xc3")
+    elif obj is False:
+        out.append(b"\xc2")
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(struct.pack("B", obj))
+        elif -32 <= obj < 0:
+            out.append(struct.pack("b", obj))
+        elif obj >= 0:
+            if obj < 0x100:
+                out.append(struct.pack(">BB", 0xcc, obj))
+            elif obj < 0x10000:
+                out.append(struct.pack(">BH", 0xcd, obj))
+            elif obj < 0x100000000:
+                out.append(struct.pack(">BI", 0xce, obj))
+            else:
+                out.append(struct.pack(">BQ", 0xcf, obj))
+        elif obj >= -0x80:
+            out.append(struct.pack(">Bb", 0xd0, obj))
+        elif obj >= -0x8000:
+            out.append(struct.pack(">Bh", 0xd1, obj))
+        elif obj >= -0x80000000:
+            out.append(struct.pack(">Bi", 0xd2, obj))
+        else:
+            out.append(struct.pack(">Bq", 0xd3, obj))
+    elif isinstance(obj, float):
+        out.append(struct.pack(">Bd", 0xcb, obj))
+    elif isinstance(obj, str):
+        b = obj.encode("utf-8")
+        n = len(b)
+        if n < 32:
+            out.append(struct.pack("B", 0xa0 | n))
+        elif n < 0x100:
+            out.append(struct.pack(">BB", 0xd9, n))
+        elif n < 0x10000:
+            out.append(struct.pack(">BH", 0xda, n))
+        else:
+            out.append(struct.pack(">BI", 0xdb, n))
+        out.append(b)
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(struct.pack("B", 0x90 | n))
+        elif n < 0x10000:
+            out.append(struct.pack(">BH", 0xdc, n))
+        else:
+            out.append(struct.pack(">BI", 0xdd, n))
+        for v in obj:
+            _mp(v, out)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            out.append(struct.pack("B", 0x80 | n))
+        elif n < 0x10000:
+            out.append(struct.pack(">BH", 0xde, n))
+        else:
+            out.append(struct.pack(">BI", 0xdf, n))
+        for k, v in obj.items():
+            _mp(k, out)
+            _mp(v, out)
+    elif isinstance(obj, bytes):
+        n = len(obj)
+        if n < 0x100:
+            out.append(struct.pack(">BB", 0xc4, n))
+        elif n < 0x10000:
+            out.append(struct.pack(">BH", 0xc5, n))
+        else:
+            out.append(struct.pack(">BI", 0xc6, n))
+        out.append(obj)
+    else:
+        _mp(str(obj), out)
+
+def pack_msgpack(obj):
+    """Pure-Python MessagePack encoder for the JSON-shaped payloads we send."""
+    out = []
+    _mp(obj, out)
+    return b"".join(out)
+
+def encode_msgpack(obj):
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    return pack_msgpack(obj)
+
+FRAME_ENCODERS = {"json": json.dumps, "msgpack": encode_msgpack}
+encode_counters = dict((enc, {"frames": 0, "bytes": 0, "seconds": 0.0}) for enc in FRAME_ENCODERS)
+
+def encode_frame(obj, encoding="json"):
+    t0 = time.perf_counter()
+    frame = FRAME_ENCODERS[encoding](obj)
+    c = encode_counters[encoding]
+    c["frames"] += 1
+    c["bytes"] += len(frame)
+    c["seconds"] += time.perf_counter() - t0
+    metric_frame_bytes.observe(len(frame))
+    return frame
+
+def frame_for(cache, obj, encoding):
+    """obj encoded for `encoding`, at most once per cache (one dict per tick)."""
+    frame = cache.get(encoding)
+    if frame is None:
+        frame = cache[encoding] = encode_frame(obj, encoding)
+    return frame
+
+def client_encoding(websocket, opts):
+    if opts.get("enc") == "msgpack" or getattr(websocket, "subprotocol", None) == "digidash.msgpack":
+        return "msgpack"
+    return "json"
+
+def websocket_serve_options():
+    """compression/extensions keyword arguments for websockets.serve()."""
+    if not WS_COMPRESSION:
+        return {"compression": None}
+    if ServerPerMessageDeflateFactory is None:
+        return {}
+    return {"compression": None, "extensions": [ServerPerMessageDeflateFactory(
+        server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        client_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        compress_settings={"memLevel": WS_DEFLATE_MEM_LEVEL})]}
+
+def bench_encodings(payloads):
+    """
+    Per encoding: mean frame bytes, mean encode time, and mean bytes after
+    permessage-deflate with our window/memLevel and context takeover.
+    """
+    out = []
+    for enc in sorted(FRAME_ENCODERS):
+        encode = FRAME_ENCODERS[enc]
+        z = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -WS_DEFLATE_WINDOW_BITS, WS_DEFLATE_MEM_LEVEL)
+        raw = 0
+        deflated = 0
+        t0 = time.perf_counter()
+        frames = [encode(p) for p in payloads]
+        secs = time.perf_counter() - t0
+        for f in frames:
+            if isinstance(f, str):
+                f = f.encode("utf-8")
+            raw += len(f)
+            # sync flush per message, minus the 4-byte trailer the extension strips
+            deflated += len(z.compress(f) + z.flush(zlib.Z_SYNC_FLUSH)) - 4
+        n = max(1, len(payloads))
+        out.append((enc, raw / n, secs / n, deflated / n))
+    return out
+
+# -----------------------------
+# Client sessions
+# -----------------------------
+# Outbox marker: encode a fresh delta snapshot when this reaches the writer
+_SNAPSHOT = object()
+
+class ClientSession(object):
+    """
+    One connected viewer. The producer only ever appends to a bounded outbox;
+    the session's own writer task does the awaiting, so a slow link holds at
+    most CLIENT_SEND_QUEUE frames and never stalls anyone else.
+    """
+    def __init__(self, websocket, protocol, encoding="json"):
+        self.websocket = websocket
+        self.protocol = protocol    # "full" or "delta"
+        self.encoding = encoding    # "json" or "msgpack"
+        self.feed = None            # ViewFeed when subscribed to a narrower view
+        self.seq = None             # last seq queued (delta clients)
+        self.outbox = deque()
+        self.replies = deque()      # query answers; sent first, never coalesced
+        self.resync_pending = False
+        self.backlogged_since = None
+        self.sending = False
+        self.writer = None
+        self._wakeup = asyncio.Event()
+
+    def start(self):
+        self.writer = asyncio.ensure_future(client_writer(self))
+
+    def close(self):
+        self.outbox.clear()
+        if self.writer is not None:
+            self.writer.cancel()
+
+    def push(self, frame):
+        if len(self.outbox) >= CLIENT_SEND_QUEUE:
+            self._overflow()
+            if self.resync_pending:
+                # the queued snapshot already covers this frame
+                return
+        self.outbox.append(frame)
+        self._wakeup.set()
+
+    def reply(self, msg):
+        self.replies.append(encode_frame(msg, self.encoding))
+        self._wakeup.set()
+
+    def request_snapshot(self):
+        """Delta clients: replace whatever is queued with one fresh snapshot."""
+        if self.resync_pending:
+            return
+        send_counters["coalesced"] += len(self.outbox)
+        self.outbox.clear()
+        self.resync_pending = True
+        self.seq = None
+        self.outbox.append(_SNAPSHOT)
+        self._wakeup.set()
+
+    def _overflow(self):
+        if self.backlogged_since is None:
+            self.backlogged_since = time.monotonic()
+        if self.protocol == "delta":
+            self.request_snapshot()
+        else:
+            # every full frame supersedes the ones before it
+            send_counters["coalesced"] += len(self.outbox)
+            self.outbox.clear()
+
+    def stalled(self, now):
+        return self.backlogged_since is not None and (now - self.backlogged_since) > CLIENT_STALL_SECONDS
+
+def parse_client_options(path):
+    opts = {}
+    try:
+        qs = parse_qs(urlsplit(path or "").query)
+        for k, v in qs.items():
+            if v:
+                opts[k] = v[-1]
+    except Exception:
+        pass
+    return opts
+
+async def send_frame(session, frame):
+    t0 = time.perf_counter()
+    try:
+        await session.websocket.send(frame)
+    except Exception as e:
+        send_counters["failed"] += 1
+        log_flush("Websocket send failed: {}".format(e))
+        connected_clients.discard(session)
+        return False
+    metric_send_seconds.observe(time.perf_counter() - t0)
+    send_counters["frames"] += 1
+    send_counters["bytes"] += len(frame)
+    return True
+
+async def client_writer(session):
+    while True:
+        if session.replies:
+            frame = session.replies.popleft()
+        elif session.outbox:
+            item = session.outbox.popleft()
+            if item is _SNAPSHOT:
+                session.resync_pending = False
+                if session.feed is None:
+                    frame = encode_delta_snapshot(session.encoding)
+                    session.seq = state_version
+                else:
+                    frame = session.feed.snapshot_frame(session.encoding)
+                    session.seq = session.feed.version
+            else:
+                frame = item
+        else:
+            session.backlogged_since = None
+            session._wakeup.clear()
+            await session._wakeup.wait()
+            continue
+        session.sending = True
+        ok = await send_frame(session, frame)
+        session.sending = False
+        if not ok:
+            return
+
+def drop_slow_client(session):
+    connected_clients.discard(session)
+    send_counters["slow_disconnects"] += 1
+    log_flush("Disconnecting slow client ({} frames replaced so far, backed up {:.0f}s)".format(
+        send_counters["coalesced"], time.monotonic() - session.backlogged_since))
+    session.close()
+    # close() gives up after close_timeout and aborts the connection
+    asyncio.ensure_future(session.websocket.close(1008, "client too slow"))
+
+# -----------------------------
+# Subscription views
+# -----------------------------
+# A client can narrow what it gets with
+#   {"type":"subscribe","modes":["DMR"],"sections":["clients_talking","mmdvm"],
+#    "tg":["91"],"last_heard":20,"interval":5}
+# or the same keys as query parameters (comma-separated lists), e.g.
+#   ws://host:port/?proto=delta&modes=DMR&tg=91&sections=clients_talking
+# Every field is optional; {"type":"subscribe"} goes back to the full view.
+# Clients with the same subscription share one ViewFeed, so each distinct
+# view is filtered, diffed and encoded once per tick however many use it.
+ViewSpec = namedtuple("ViewSpec", "modes sections targets depth interval")
+DEFAULT_LAST_HEARD = 10
+STATUS_MODES = {"mmdvm": "DMR", "p25": "P25", "ysf": "YSF"}
+
+def _spec_list(value, name):
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        raise ValueError("{} must be a list".format(name))
+    items = [str(v).strip() for v in value if str(v).strip()]
+    return items or None
+
+def parse_view_spec(msg):
+    """ViewSpec for a subscribe message / query options, or None for the full view."""
+    modes = _spec_list(msg.get("modes"), "modes")
+    sections = _spec_list(msg.get("sections"), "sections")
+    targets = _spec_list(msg.get("tg"), "tg")
+    if sections:
+        known = DELTA_SECTIONS + STATUS_SECTIONS
+        for name in sections:
+            if name not in known:
+                raise ValueError("unknown section {} (have {})".format(name, ", ".join(known)))
+    try:
+        depth = int(msg.get("last_heard") or DEFAULT_LAST_HEARD)
+        interval = float(msg.get("interval") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("last_heard and interval must be numbers")
+    spec = ViewSpec(
+        frozenset(m.upper() for m in modes) if modes else None,
+        frozenset(sections) if sections else None,
+        frozenset(history_target(t) for t in targets) if targets else None,
+        max(1, min(depth, MAX_LAST_HEARD)),
+        max(0.0, min(interval, 3600.0)),
+    )
+    if spec == ViewSpec(None, None, None, DEFAULT_LAST_HEARD, 0.0):
+        return None
+    return spec
+
+def describe_view(spec):
+    if spec is None:
+        return {}
+    return {"modes": sorted(spec.modes) if spec.modes else None,
+            "sections": sorted(spec.sections) if spec.sections else None,
+            "tg": sorted(spec.targets) if spec.targets else None,
+            "last_heard": spec.depth, "interval": spec.interval}
+
+def _row_matches(spec, row, module_field):
+    if spec.modes is not None and (row.get("source") or "").upper() not in spec.modes:
+        return False
+    if spec.targets is not None and history_target(row.get(module_field)) not in spec.targets:
+        return False
+    return True
+
+def build_view(spec):
+    """The state one subscription sees, cut from latest_state (and the last-heard ring)."""
+    state = latest_state or {}
+    combined = state.get("combined") or {}
+    view = {"combined": {}}
+    wanted = spec.sections
+
+    if wanted is None or "clients_talking" in wanted:
+        view["combined"]["clients_talking"] = [
+            r for r in combined.get("clients_talking") or [] if _row_matches(spec, r, "module")]
+    if wanted is None or "last_heard" in wanted:
+        rows = []
+        for r in deep_last_heard():
+            if _row_matches(spec, r, "module_or_tg"):
+                rows.append(r)
+                if len(rows) >= spec.depth:
+                    break
+        view["combined"]["last_heard"] = rows
+    if wanted is None or "peers" in wanted:
+        view["combined"]["peers"] = [
+            r for r in combined.get("peers") or [] if _row_matches(spec, r, "module")]
+
+    for name in STATUS_SECTIONS:
+        if name not in state or (wanted is not None and name not in wanted):
+            continue
+        mode = status_section_mode(name)
+        if spec.modes is not None and mode is not None and mode not in spec.modes:
+            continue
+        view[name] = state[name]
+    return view
+
+def deep_last_heard():
+    """Last heard rows as deep as a view can ask for."""
+    if fanout_link is not None:
+        return fanout_link.last_heard
+    if hub_nodes:
+        # the hub keeps no ring; its merged rows are as deep as it goes
+        return ((latest_state or {}).get("combined") or {}).get("last_heard") or []
+    return (last_heard_row(e) for e in last_heard.newest(MAX_LAST_HEARD))
+
+def status_section_mode(name):
+    if name in STATUS_MODES:
+        return STATUS_MODES[name]
+    for mode in declarative_modes:
+        if mode.status_key == name:
+            return mode.name
+    return None
+
+class ViewFeed(object):
+    """One distinct subscription: its own state, seq and encoded frames."""
+    def __init__(self, spec):
+        self.spec = spec
+        self.sessions = set()
+        self.state = None
+        self.delta = None
+        self.version = 0
+        self.pending = True
+        self.next_due = 0.0
+        self.next_heartbeat = 0.0
+        self.full_frames = {}
+        self._snapshot = (None, {})
+
+    def refresh(self, now):
+        """Rebuild the view if it's due. Returns True if it changed."""
+        if now < self.next_due:
+            return False
+        self.pending = False
+        state = build_view(self.spec)
+        if state == self.state:
+            return False
+        self.delta = diff_states(self.state, state)
+        self.state = state
+        self.version += 1
+        self.next_due = now + self.spec.interval
+        return True
+
+    def payload(self):
+        data = dict(self.state or {})
+        data["uptime_seconds"] = get_uptime_seconds()
+        return data
+
+    def snapshot_frame(self, encoding):
+        seq, frames = self._snapshot
+        if seq != self.version:
+            frames = {}
+            self._snapshot = (self.version, frames)
+        if encoding not in frames:
+            frames[encoding] = encode_frame(snapshot_message(self.state or {}, self.version), encoding)
+        return frames[encoding]
+
+    def tick(self, changed, heartbeat_due):
+        now = time.monotonic()
+        if changed:
+            self.pending = True
+        if self.pending and self.refresh(now):
+            self.next_heartbeat = now + max(SNAPSHOT_HEARTBEAT_SECONDS, self.spec.interval)
+            self.full_frames = fan_out(self.sessions, self.version, self.payload(), self.delta, True, False)
+        elif heartbeat_due and now >= self.next_heartbeat:
+            self.next_heartbeat = now + max(SNAPSHOT_HEARTBEAT_SECONDS, self.spec.interval)
+            self.full_frames = fan_out(self.sessions, self.version, self.payload(), None, False, True)
+
+view_feeds = {}
+
+def set_view(session, spec):
+    """Moves the session to the feed for spec (None = full view) and restarts its stream."""
+    old = session.feed
+    if old is not None:
+        old.sessions.discard(session)
+        if not old.sessions:
+            view_feeds.pop(old.spec, None)
+    feed = None
+    if spec is not None:
+        feed = view_feeds.get(spec)
+        if feed is None:
+            feed = view_feeds[spec] = ViewFeed(spec)
+            feed.refresh(time.monotonic())
+        feed.sessions.add(session)
+    session.feed = feed
+    if session.protocol == "delta":
+        if feed is not None or latest_state is not None:
+            session.request_snapshot()
+    else:
+        session.outbox.clear()
+        if feed is not None:
+            session.push(frame_for(feed.full_frames, feed.payload(), session.encoding))
+        elif latest_frame is not None:
+            session.push(frame_for(latest_frames, latest_data, session.encoding))
+
+def update_message(seq, payload, delta, changed):
+    """What delta clients get this tick: the delta to seq, or a heartbeat."""
+    if not changed:
+        return {"type": "heartbeat", "seq": seq, "uptime_seconds": payload.get("uptime_seconds")}
+    msg = {"type": "delta", "seq": seq, "uptime_seconds": payload.get("uptime_seconds")}
+    msg.update(delta or {})
+    return msg
+
+def fan_out(sessions, seq, payload, delta, changed, heartbeat_due, full_frames=None, update_frames=None):
+    """
+    Queues one view's frames on its sessions: the full payload for full
+    clients, the delta to seq (or a heartbeat) for delta clients. Each frame
+    is encoded once per encoding; full_frames / update_frames can bring
+    frames already encoded elsewhere. Returns the full frames by encoding.
+    """
+    full_frames = {} if full_frames is None else full_frames
+    update_frames = {} if update_frames is None else update_frames
+    delta_sessions = []
+    for s in sessions:
+        if s.protocol != "full":
+            delta_sessions.append(s)
+        elif changed or heartbeat_due:
+            s.push(frame_for(full_frames, payload, s.encoding))
+
+    if delta_sessions and changed:
+        msg = update_message(seq, payload, delta, True)
+        for s in delta_sessions:
+            if s.resync_pending:
+                continue
+            if s.seq == seq - 1:
+                s.seq = seq
+                s.push(frame_for(update_frames, msg, s.encoding))
+            else:
+                # Missed something server-side; heal with a snapshot
+                s.request_snapshot()
+    elif delta_sessions and heartbeat_due:
+        msg = update_message(seq, payload, delta, False)
+        for s in delta_sessions:
+            # liveness only; anything already queued proves that too
+            if not s.outbox:
+                s.push(frame_for(update_frames, msg, s.encoding))
+    return full_frames
+
+async def broadcast(changed, heartbeat_due, full_frames=None, update_frames=None):
+    """
+    Queues this tick's frames on every session; never waits on a socket.
+    A fan-out worker passes the JSON frames the ingestion process encoded.
+    """
+    global latest_frame, latest_frames
+    sessions = list(connected_clients)
+
+    if heartbeat_due or changed or latest_frame is None:
+        latest_frames = fan_out([s for s in sessions if s.feed is None], state_version,
+                                latest_data, latest_delta, changed, True, full_frames, update_frames)
+        latest_frame = frame_for(latest_frames, latest_data, "json")
+    for feed in list(view_feeds.values()):
+        feed.tick(changed, heartbeat_due)
+    if fanout_publisher is not None:
+        fanout_publisher.publish(changed, heartbeat_due)
+
+    now = time.monotonic()
+    for s in sessions:
+        if s.stalled(now):
+            drop_slow_client(s)
+
+async def snapshot_producer():
+    global latest_data, push_loop, push_event
+    loop = asyncio.get_event_loop()
+    push_event = asyncio.Event()
+    push_loop = loop
+    next_heartbeat = loop.time()
+
+    while True:
+        timeout = next_heartbeat - loop.time()
+        deadline = expiry.next_deadline()
+        if deadline is not None:
+            timeout = min(timeout, deadline - now_epoch())
+        try:
+            await asyncio.wait_for(push_event.wait(), max(0.0, timeout))
+            # Let the rest of a burst land so it goes out as one push
+            await asyncio.sleep(PUSH_COALESCE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _push_pending.clear()
+        push_event.clear()
+
+        try:
+            t0 = time.perf_counter()
+            latest_data = build_snapshot()
+            changed = note_snapshot(latest_data)
+            metric_build_seconds.observe(time.perf_counter() - t0)
+            heartbeat_due = loop.time() >= next_heartbeat
+            if changed or heartbeat_due:
+                next_heartbeat = loop.time() + SNAPSHOT_HEARTBEAT_SECONDS
+                await broadcast(changed, heartbeat_due)
+        except Exception as e:
+            log_flush("Snapshot producer error: {}".format(e))
+
+# -----------------------------
+# /metrics (plain HTTP on the websocket port)
+# -----------------------------
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _enabled_units():
+    units = set()
+    if ENABLE_M17:
+        units.add(M17_UNIT)
+    if ENABLE_DMR:
+        units.add(DMR_UNIT)
+    if ENABLE_P25:
+        units.add(P25_UNIT)
+    if ENABLE_YSF:
+        units.add(YSF_UNIT)
+    for mode in declarative_modes:
+        units.add(mode.unit)
+    return units
+
+def client_counters():
+    """The per-client counters, in the form fan-out workers report them."""
+    by_proto = {"full": 0, "delta": 0}
+    for s in list(connected_clients):
+        by_proto[s.protocol] = by_proto.get(s.protocol, 0) + 1
+    return {"send": dict(send_counters),
+            "encode": dict((enc, dict(c)) for enc, c in encode_counters.items()),
+            "http": dict(http_snapshot_counters),
+            "clients": by_proto,
+            "queued": sum(len(s.outbox) for s in list(connected_clients)),
+            "views": len(view_feeds),
+            "frame_bytes": metric_frame_bytes.state(),
+            "send_seconds": metric_send_seconds.state()}
+
+def _sum_counters(a, b):
+    if isinstance(a, dict):
+        out = dict(a)
+        for k, v in b.items():
+            out[k] = _sum_counters(out[k], v) if k in out else v
+        return out
+    if isinstance(a, list):
+        return [_sum_counters(x, y) for x, y in zip(a, b)]
+    return a + b
+
+def render_metrics():
+    out = []
+    clients = client_counters()
+    if fanout_publisher is not None:
+        for report in list(fanout_publisher.reports.values()):
+            clients = _sum_counters(clients, report or {})
+
+    def metric(name, kind, help_text, samples):
+        out.append("# HELP {} {}".format(name, help_text))
+        out.append("# TYPE {} {}".format(name, kind))
+        for labels, value in samples:
+            out.append("{}{} {}".format(name, labels, value))
+
+    units = _enabled_units()
+    all_queues = [m17_q, dmr_q, p25_q, ysf_q] + [mode.queue for mode in declarative_modes]
+    queues = [q for q in all_queues if q.ingested or q.unit in units]
+    metric("digidash_lines_ingested_total", "counter", "Journal lines queued for parsing",
+           [('{{unit="{}"}}'.format(_label(q.unit)), q.ingested) for q in queues])
+    metric("digidash_lines_dropped_total", "counter", "Journal lines dropped by MAX_QUEUE trimming",
+           [('{{unit="{}"}}'.format(_label(q.unit)), q.dropped) for q in queues])
+    metric("digidash_queue_depth", "gauge", "Lines waiting to be parsed",
+           [('{{unit="{}"}}'.format(_label(q.unit)), len(q)) for q in queues])
+
+    now = time.time()
+    fl = [(f, '{{follower="{}"}}'.format(_label(f.unit_name))) for f in followers]
+    metric("digidash_follower_last_line_age_seconds", "gauge", "Seconds since the follower last read a line (-1 = never)",
+           [(lbl, round(now - f.last_line_time, 3) if f.last_line_time else -1) for f, lbl in fl])
+    metric("digidash_follower_spawns_total", "counter", "journalctl processes / journal readers started",
+           [(lbl, f.spawn_count) for f, lbl in fl])
+    metric("digidash_follower_deaths_total", "counter", "journalctl processes / journal readers that ended",
+           [(lbl, f.dead_count) for f, lbl in fl])
+
+    metric_parse_seconds.render(out)
+    metric_build_seconds.render(out)
+    metric_frame_bytes.render(out, clients["frame_bytes"])
+    metric_send_seconds.render(out, clients["send_seconds"])
+    metric_history_query_seconds.render(out)
+    encs = sorted(clients["encode"].items())
+    metric("digidash_encoded_frames_total", "counter", "Frames encoded, per encoding",
+           [('{{encoding="{}"}}'.format(enc), c["frames"]) for enc, c in encs])
+    metric("digidash_encoded_bytes_total", "counter", "Encoded frame bytes before permessage-deflate, per encoding",
+           [('{{encoding="{}"}}'.format(enc), c["bytes"]) for enc, c in encs])
+    metric("digidash_encode_seconds_total", "counter", "Time spent encoding frames, per encoding",
+           [('{{encoding="{}"}}'.format(enc), round(c["seconds"], 6)) for enc, c in encs])
+    sends = clients["send"]
+    metric("digidash_frames_sent_total", "counter", "Websocket frames sent", [("", sends["frames"])])
+    metric("digidash_bytes_sent_total", "counter", "Websocket payload bytes sent", [("", sends["bytes"])])
+    metric("digidash_send_failures_total", "counter", "Websocket sends that failed", [("", sends["failed"])])
+    metric("digidash_frames_coalesced_total", "counter", "Queued frames replaced by a newer frame for a slow client",
+           [("", sends["coalesced"])])
+    metric("digidash_slow_client_disconnects_total", "counter", "Clients dropped after staying backed up past CLIENT_STALL_SECONDS",
+           [("", sends["slow_disconnects"])])
+
+    metric("digidash_connected_clients", "gauge", "Connected websocket clients",
+           [('{{protocol="{}"}}'.format(p), n) for p, n in sorted(clients["clients"].items())])
+    metric("digidash_http_snapshot_requests_total", "counter", "GET /snapshot.json requests, per status",
+           [('{{code="{}"}}'.format(code), n) for code, n in sorted(clients["http"].items())])
+    metric("digidash_views", "gauge", "Distinct subscription views being built",
+           [("", clients["views"])])
+    metric("digidash_client_queued_frames", "gauge", "Frames waiting in client send queues",
+           [("", clients["queued"])])
+    metric("digidash_state_version", "counter", "Snapshot state changes since start", [("", state_version)])
+    metric("digidash_expired_total", "counter", "Talkers, M17 streams and peers aged out by the expiry scheduler", [("", expiry.expired)])
+    metric("digidash_expiry_pending", "gauge", "Entries waiting for their expiry deadline", [("", expiry.pending())])
+
+    if activity_stats is not None:
+        metric("digidash_stats_tracked_keys", "gauge", "Callsigns / talkgroups with activity counters",
+               [('{{by="{}"}}'.format(by), len(t)) for by, t in sorted(activity_stats.tables.items())])
+        metric("digidash_stats_evicted_total", "counter", "Least recently heard keys dropped at STATS_MAX_KEYS",
+               [("", activity_stats.evicted)])
+
+    if fanout_publisher is not None:
+        metric("digidash_fanout_workers", "gauge", "Fan-out worker processes connected",
+               [("", len(fanout_publisher.links))])
+        metric("digidash_fanout_restarts_total", "counter", "Fan-out worker processes that exited and were restarted",
+               [("", fanout_publisher.restarts)])
+
+    if hub_nodes:
+        hl = [(n, '{{node="{}"}}'.format(_label(n.name))) for n in hub_nodes]
+        metric("digidash_upstream_connected", "gauge", "1 while the hub is connected to the node",
+               [(lbl, 1 if n.connected else 0) for n, lbl in hl])
+        metric("digidash_upstream_frames_total", "counter", "Frames received from the node",
+               [(lbl, n.frames) for n, lbl in hl])
+        metric("digidash_upstream_resyncs_total", "counter", "Resyncs requested from the node after a seq gap",
+               [(lbl, n.resyncs) for n, lbl in hl])
+        metric("digidash_upstream_reconnects_total", "counter", "Times the connection to the node was lost or refused",
+               [(lbl, n.reconnects) for n, lbl in hl])
+
+    if history_store is not None:
+        metric("digidash_history_written_total", "counter", "Rows written to the history database", [("", history_store.written)])
+        metric("digidash_history_pending", "gauge", "Rows waiting for the history writer", [("", history_store.pending())])
+
+    return "\n".join(out) + "\n"
+
+# The body is the JSON full frame broadcast already built, kept as bytes until
+# state_version moves, so unchanged polls cost a header compare. The ETag
+# carries a per-process token: state_version starts over on a restart and
+# mustn't match a copy cached from the previous run.
+_etag_token = "{:x}".format(int(time.time()))
+_http_snapshot = {"seq": None, "etag": None, "body": None}
+http_snapshot_counters = {"200": 0, "304": 0, "503": 0}
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
+
+def http_snapshot(request_headers):
+    if latest_frame is None:
+        http_snapshot_counters["503"] += 1
+        return (http.HTTPStatus.SERVICE_UNAVAILABLE,
+                [("Content-Type", "text/plain"), ("Retry-After", "1")],
+                b"no snapshot built yet\n")
+    cache = _http_snapshot
+    if cache["seq"] != state_version:
+        cache["seq"] = state_version
+        cache["etag"] = '"{}-{}"'.format(_etag_token, state_version)
+        cache["body"] = latest_frame.encode("utf-8")
+    headers = [("ETag", cache["etag"]), ("Cache-Control", "no-cache")]
+    if etag_matches(request_headers.get("If-None-Match"), cache["etag"]):
+        http_snapshot_counters["304"] += 1
+        return (http.HTTPStatus.NOT_MODIFIED, headers, b"")
+    http_snapshot_counters["200"] += 1
+    headers.append(("Content-Type", "application/json"))
+    return (http.HTTPStatus.OK, headers, cache["body"])
+
+async def process_http_request(path, request_headers):
+    """
+    Handshake hook: answers GET METRICS_PATH with the metrics text and
+    GET SNAPSHOT_PATH with the current payload; anything else returns None
+    and carries on as a websocket connection.
+    """
+    route = urlsplit(path or "").path
+    if ENABLE_METRICS and route == METRICS_PATH:
+        if fanout_link is not None:
+            body = (await fanout_link.metrics()).encode("utf-8")
+        else:
+            body = render_metrics().encode("utf-8")
+        return (http.HTTPStatus.OK,
+                [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                 ("Cache-Control", "no-cache")],
+                body)
+    if ENABLE_SNAPSHOT_HTTP and route == SNAPSHOT_PATH:
+        return http_snapshot(request_headers)
+    return None
+
+# -----------------------------
+# History queries over the websocket
+# -----------------------------
+#   -> {"type":"history","id":1,"callsign":"N0CALL","mode":"DMR","tg":"91",
+#       "since":<epoch>,"until":<epoch>,"limit":50,"before":<cursor>}
+#   <- {"type":"history","id":1,"rows":[...],"next":<cursor or null>}
+#   <- {"type":"history","id":1,"error":"..."}
+# Every filter is optional. "tg" / "module" / "target" all match the indexed
+# target column ("91" for "S2 / TG 91"). Pass "next" back as "before" for the
+# following page.
+def parse_history_query(msg):
+    """Keyword arguments for HistoryStore.query; raises ValueError on bad input."""
+    def text(name):
+        v = msg.get(name)
+        if v is None or v == "":
+            return None
+        if isinstance(v, bool) or not isinstance(v, (str, int)):
+            raise ValueError("{} must be a string".format(name))
+        return str(v).strip() or None
+
+    def number(name):
+        v = msg.get(name)
+        if v is None:
+            return None
+        if isinstance(v, bool) or not isinstance(v, (int, float)):
+            raise ValueError("{} must be epoch seconds".format(name))
+        return float(v)
+
+    q = {
+        "callsign": text("callsign"),
+        "protocol": (text("mode") or text("protocol") or "").upper() or None,
+        "target": history_target(text("tg") or text("target") or text("module")),
+        "since": number("since"),
+        "until": number("until"),
+        "before": None,
+        "limit": HISTORY_QUERY_DEFAULT_ROWS,
+    }
+    limit = msg.get("limit")
+    if limit is not None:
+        if isinstance(limit, bool) or not isinstance(limit, int):
+            raise ValueError("limit must be an integer")
+        q["limit"] = max(1, min(limit, HISTORY_QUERY_MAX_ROWS))
+    cursor = text("before")
+    if cursor:
+        try:
+            epoch, _, rowid = cursor.partition(":")
+            q["before"] = (float(epoch), int(rowid))
+        except ValueError:
+            raise ValueError("before must be a cursor from a previous page")
+    return q
+
+async def answer_history_query(session, msg):
+    reply = {"type": "history", "id": msg.get("id")}
+    if history_store is None:
+        reply["error"] = "history is not enabled on this server"
+    else:
+        try:
+            kwargs = parse_history_query(msg)
+        except ValueError as e:
+            reply["error"] = str(e)
+        else:
+            t0 = time.perf_counter()
+            try:
+                loop = asyncio.get_event_loop()
+                rows, cursor = await loop.run_in_executor(history_store.query_executor,
+                                                          partial(history_store.query, **kwargs))
+                reply["rows"] = rows
+                reply["next"] = cursor
+            except Exception as e:
+                log_flush("History query failed: {}".format(e))
+                reply["error"] = "query failed"
+            metric_history_query_seconds.observe(time.perf_counter() - t0)
+    session.reply(reply)
+
+# -----------------------------
+# Activity statistics over the websocket
+# -----------------------------
+#   -> {"type":"stats","id":1,"by":"callsign"|"talkgroup","window":"1h"|"24h"|"7d",
+#       "sort":"talk"|"keyups","limit":10}
+#   -> {"type":"stats","id":1,"by":"callsign","key":"N0CALL","window":"7d"}
+#   <- {"type":"stats","id":1,"by":...,"window":...,"rows":[{"key","talk_seconds",
+#       "keyups","busiest_hour","last_epoch"}],"totals":{"talk_seconds","keyups"}}
+# Talkgroup keys are "<MODE>:<target>", e.g. "DMR:91", "M17:A", "YSF:0".
+def answer_stats_query(session, msg):
+    reply = {"type": "stats", "id": msg.get("id")}
+    by = msg.get("by") or "callsign"
+    window = msg.get("window") or "24h"
+    sort = msg.get("sort") or "talk"
+    limit = msg.get("limit", 10)
+    key = msg.get("key")
+    if activity_stats is None:
+        reply["error"] = "statistics are not enabled on this server"
+    elif by not in activity_stats.tables:
+        reply["error"] = "by must be callsign or talkgroup"
+    elif window not in STATS_WINDOWS:
+        reply["error"] = "window must be one of {}".format(", ".join(STATS_WINDOWS))
+    elif sort not in ("talk", "keyups"):
+        reply["error"] = "sort must be talk or keyups"
+    elif isinstance(limit, bool) or not isinstance(limit, int):
+        reply["error"] = "limit must be an integer"
+    elif key is not None and not isinstance(key, str):
+        reply["error"] = "key must be a string"
+    else:
+        now = now_epoch()
+        reply["by"] = by
+        reply["window"] = window
+        if key is not None:
+            key = key.strip().upper()
+            row = activity_stats.lookup(by, key, window, now)
+            reply["rows"] = [row] if row else []
+        else:
+            reply["rows"] = activity_stats.top(by, window, now, max(1, min(limit, 100)), sort)
+        reply["totals"] = activity_stats.totals(window, now)
+    session.reply(reply)
 
 # -----------------------------
 # Websocket handler
 # -----------------------------
+async def handle_client_message(session, raw):
+    try:
+        msg = json.loads(raw)
+    except Exception:
+        return
+    if not isinstance(msg, dict):
+        return
+    if msg.get("type") == "resync" and session.protocol == "delta":
+        log_flush("Client requested resync (had seq {}, now {})".format(msg.get("seq"), state_version))
+        session.request_snapshot()
+    elif msg.get("type") in ("history", "stats") and fanout_link is not None:
+        fanout_link.forward(session, msg)
+    elif msg.get("type") == "history":
+        await answer_history_query(session, msg)
+    elif msg.get("type") == "stats":
+        answer_stats_query(session, msg)
+    elif msg.get("type") == "subscribe":
+        try:
+            spec = parse_view_spec(msg)
+        except ValueError as e:
+            session.reply({"type": "subscribed", "error": str(e)})
+            return
+        session.reply({"type": "subscribed", "view": describe_view(spec)})
+        set_view(session, spec)
+
 async def websocket_handler(websocket, path):
-    while True:
-        parse_journal_queues()
-
-        combined_obj = {
-            "clients_talking": build_combined_clients_talking(),
-            "last_heard": build_combined_last_heard(10),
-            "peers": build_combined_peers(10) if ENABLE_M17 else [],
-        }
-
-        data = {
-            "uptime_seconds": get_uptime_seconds(),
-            "combined": combined_obj,
-        }
-
-        if ENABLE_DMR:
-            data["mmdvm"] = mmdvm_status
-        if ENABLE_P25:
-            data["p25"] = p25_status
-        if ENABLE_YSF:
-            data["ysf"] = ysf_status
+    opts = parse_client_options(path)
+    session = ClientSession(websocket, "delta" if opts.get("proto") == "delta" else "full",
+                            client_encoding(websocket, opts))
+    try:
+        spec = parse_view_spec(opts)
+    except ValueError as e:
+        log_flush("Ignoring bad view in {}: {}".format(path, e))
+        spec = None
+    connected_clients.add(session)
+    session.start()
+    log_flush("Client connected ({} total, {}, {})".format(len(connected_clients), session.protocol, session.encoding))
+    try:
+        # Don't make a new viewer wait for the next tick
+        set_view(session, spec)
+        # Frames are queued by snapshot_producer and written by the session's
+        # writer; just hold the connection open and answer control messages
+        # until the browser goes away.
+        while True:
+            raw = await websocket.recv()
+            await handle_client_message(session, raw)
+    except Exception:
+        pass
+    finally:
+        connected_clients.discard(session)
+        if session.feed is not None:
+            set_view(session, None)
+        session.close()
+        log_flush("Client disconnected ({} total)".format(len(connected_clients)))
 
+# -----------------------------
+# Hub mode (--hub / --upstream)
+# -----------------------------
+# Each upstream node is followed as a delta client and its state kept here.
+# build_snapshot() merges the nodes instead of parsing the journal, so the
+# hub's own viewers get the usual full/delta frames from the usual producer.
+hub_nodes = []
+
+class UpstreamNode(object):
+    """One upstream DigiDash server and the state last received from it."""
+    def __init__(self, name, url, verify_tls=True):
+        self.name = name
+        self.url = url
+        self.verify_tls = verify_tls
+        self.connected = False
+        self.seq = None
+        self.resync_needed = False
+        self.rows = dict((section, []) for section in DELTA_SECTIONS)
+        self.status = {}
+        self.frames = 0
+        self.resyncs = 0
+        self.reconnects = 0
+        self.last_frame_time = None
+        self.last_error = None
+
+    def apply(self, msg):
+        """
+        Applies one frame from the node. Returns True if its state changed;
+        sets resync_needed when a seq gap means the node must resend.
+        """
+        if not isinstance(msg, dict):
+            return False
+        self.frames += 1
+        self.last_frame_time = time.time()
+        kind = msg.get("type")
+
+        if kind == "snapshot":
+            combined = msg.get("combined") or {}
+            self.rows = dict((section, list(combined.get(section) or [])) for section in DELTA_SECTIONS)
+            self.status = dict((k, v) for k, v in msg.items() if k not in _FRAME_KEYS)
+            self.seq = msg.get("seq")
+            self.resync_needed = False
+            return True
+
+        if kind == "heartbeat":
+            if self.seq is None or msg.get("seq") != self.seq:
+                self.resync_needed = True
+            return False
+
+        if kind == "delta":
+            if self.seq is None or msg.get("seq") != self.seq + 1:
+                self.resync_needed = True
+                return False
+            for section, d in (msg.get("combined") or {}).items():
+                if section not in self.rows:
+                    continue
+                by_key = dict((r.get("key"), r) for r in self.rows[section])
+                for k in d.get("removed") or []:
+                    by_key.pop(k, None)
+                for r in (d.get("added") or []) + (d.get("updated") or []):
+                    by_key[r.get("key")] = r
+                order = d.get("order")
+                if order is None:
+                    self.rows[section] = list(by_key.values())
+                elif all(k in by_key for k in order):
+                    self.rows[section] = [by_key[k] for k in order]
+                else:
+                    self.resync_needed = True
+                    return False
+            for k, v in msg.items():
+                if k not in _FRAME_KEYS:
+                    self.status[k] = v
+            self.seq = msg.get("seq")
+            return True
+
+        # Full-protocol frame (no "type"): take it whole
+        if "combined" in msg:
+            combined = msg.get("combined") or {}
+            self.rows = dict((section, list(combined.get(section) or [])) for section in DELTA_SECTIONS)
+            self.status = dict((k, v) for k, v in msg.items() if k not in _FRAME_KEYS)
+            return True
+        return False
+
+    def disconnected(self):
+        """Live sections are stale once the link is gone; last heard stays."""
+        self.connected = False
+        self.seq = None
+        self.resync_needed = False
+        self.rows["clients_talking"] = []
+        self.rows["peers"] = []
+
+_FRAME_KEYS = ("type", "seq", "uptime_seconds", "combined")
+
+def _hub_row(row, node):
+    r = dict(row)
+    r.pop("key", None)
+    r["node"] = node
+    r["nodes"] = [node]
+    return r
+
+def _echo_key(row, module_field):
+    """What has to match for two nodes' rows to be the same transmission."""
+    return ((normalize_callsign(row.get("callsign")) or "").upper(),
+            (row.get("source") or "").upper(),
+            (row.get("protocol") or "").upper(),
+            history_target(row.get(module_field)))
+
+def _echo_of(kept, row, node, epoch_field, dedup_seconds):
+    """
+    kept: rows already merged under row's _echo_key. Returns the one `row`
+    echoes, or None. A node never echoes itself: two of its own rows are two
+    transmissions however close together.
+    """
+    epoch = row.get(epoch_field)
+    for k in kept:
+        if node in k["nodes"]:
+            continue
+        ref = k.get(epoch_field)
+        if epoch is None or ref is None:
+            if epoch is None and ref is None:
+                return k
+            continue
+        if abs(epoch - ref) <= dedup_seconds:
+            return k
+    return None
+
+def merge_hub_rows(nodes, dedup_seconds, last_heard_n):
+    """
+    Combined sections for the hub: every node's rows tagged with its name,
+    with cross-node echoes of the same transmission folded into one row.
+    """
+    talking = []
+    talking_by_key = {}
+    for node in nodes:
+        for row in node.rows.get("clients_talking") or []:
+            kept = talking_by_key.setdefault(_echo_key(row, "module"), [])
+            echo = _echo_of(kept, row, node.name, "start_epoch", dedup_seconds)
+            if echo is not None:
+                echo["nodes"].append(node.name)
+                continue
+            r = _hub_row(row, node.name)
+            kept.append(r)
+            talking.append(r)
+
+    heard = []
+    for node in nodes:
+        for row in node.rows.get("last_heard") or []:
+            heard.append(_hub_row(row, node.name))
+    # newest first; rows without an epoch sort last
+    heard.sort(key=lambda r: r.get("epoch") if r.get("epoch") is not None else float("-inf"), reverse=True)
+    last_heard = []
+    heard_by_key = {}
+    for r in heard:
+        kept = heard_by_key.setdefault(_echo_key(r, "module_or_tg"), [])
+        echo = _echo_of(kept, r, r["node"], "epoch", dedup_seconds)
+        if echo is not None:
+            echo["nodes"].append(r["node"])
+            continue
+        kept.append(r)
+        last_heard.append(r)
+        if len(last_heard) >= last_heard_n:
+            break
+
+    peers_out = []
+    for node in nodes:
+        for row in node.rows.get("peers") or []:
+            peers_out.append(_hub_row(row, node.name))
+
+    return {"clients_talking": talking, "last_heard": last_heard, "peers": peers_out}
+
+def build_hub_snapshot():
+    data = {
+        "uptime_seconds": get_uptime_seconds(),
+        "combined": merge_hub_rows(hub_nodes, HUB_DEDUP_SECONDS, HUB_LAST_HEARD),
+        "nodes": dict((node.name, dict(node.status, connected=node.connected)) for node in hub_nodes),
+    }
+    return data
+
+def _delta_url(url):
+    parts = urlsplit(url)
+    query = parts.query
+    if "proto=" not in query:
+        query = "{}&proto=delta".format(query) if query else "proto=delta"
+    return urlunsplit((parts.scheme, parts.netloc, parts.path or "/", query, parts.fragment))
+
+def _upstream_ssl(node):
+    if not node.url.startswith("wss:"):
+        return None
+    ctx = ssl.create_default_context()
+    if not node.verify_tls:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+async def upstream_loop(node):
+    """Keeps one connection to the node open for the life of the hub."""
+    url = _delta_url(node.url)
+    delay = HUB_RECONNECT_SECONDS
+    while True:
         try:
-            await websocket.send(json.dumps(data))
+            ws = await websockets.connect(url, ssl=_upstream_ssl(node), max_size=None)
+            node.connected = True
+            node.last_error = None
+            delay = HUB_RECONNECT_SECONDS
+            log_flush("Hub: connected to {} ({})".format(node.name, node.url))
+            notify_push()
+            try:
+                while True:
+                    raw = await ws.recv()
+                    try:
+                        msg = json.loads(raw)
+                    except Exception:
+                        continue
+                    if node.apply(msg):
+                        notify_push()
+                    if node.resync_needed:
+                        node.resync_needed = False
+                        node.resyncs += 1
+                        await ws.send(json.dumps({"type": "resync", "seq": node.seq}))
+            finally:
+                await ws.close()
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            log_flush("Websocket send failed: {}".format(e))
+            node.last_error = str(e) or type(e).__name__
+        if node.connected:
+            log_flush("Hub: lost {} ({})".format(node.name, node.last_error))
+        node.disconnected()
+        node.reconnects += 1
+        notify_push()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, HUB_RECONNECT_MAX_SECONDS)
+
+def setup_hub(args):
+    """Builds hub_nodes from --upstream (or HUB_UPSTREAMS). Returns False if there are none."""
+    global hub_nodes, STATUS_SECTIONS
+    specs = list(HUB_UPSTREAMS)
+    if args.upstream:
+        specs = []
+        for spec in args.upstream:
+            name, _, url = spec.partition("=")
+            if not name or not url:
+                print("--upstream expects NODE=URL")
+                raise SystemExit(2)
+            specs.append({"node": name.strip(), "url": url.strip()})
+    hub_nodes = [UpstreamNode(s["node"], s["url"], s.get("verify_tls", True)) for s in specs]
+    if not hub_nodes:
+        return False
+    if "nodes" not in STATUS_SECTIONS:
+        STATUS_SECTIONS = STATUS_SECTIONS + ("nodes",)
+    return True
+
+# -----------------------------
+# Fan-out workers (--workers N)
+# -----------------------------
+# The ingestion process (followers, parsers, history, stats, or the hub
+# upstreams) stops serving clients and publishes every tick to N worker
+# processes over a Unix socket. Each message is
+#   [4-byte length][JSON header][parts...]
+# and a tick's parts are its frames, already JSON-encoded once: the full
+# payload and the delta (or heartbeat). Workers mirror the state from them,
+# share WS_PORT through SO_REUSEPORT and run the usual per-client fan-out
+# (views, msgpack, /snapshot.json). History and stats queries, and /metrics,
+# are answered by the ingestion process, which has the data; workers report
+# their client counters about once a second so /metrics covers them all.
+_FANOUT_LENGTH = struct.Struct(">I")
+FANOUT_MAX_BUFFER = 8 * 1024 * 1024
+fanout_publisher = None
+fanout_link = None
+
+def write_message(writer, header, parts=()):
+    parts = [p.encode("utf-8") if isinstance(p, str) else p for p in parts]
+    header = dict(header, sizes=[len(p) for p in parts])
+    body = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    writer.write(_FANOUT_LENGTH.pack(len(body)) + body)
+    for p in parts:
+        writer.write(p)
+
+async def read_message(reader):
+    size, = _FANOUT_LENGTH.unpack(await reader.readexactly(_FANOUT_LENGTH.size))
+    header = json.loads((await reader.readexactly(size)).decode("utf-8"))
+    parts = []
+    for n in header.get("sizes") or ():
+        parts.append((await reader.readexactly(n)).decode("utf-8"))
+    return header, parts
+
+def fanout_socket_path():
+    if FANOUT_SOCKET:
+        return FANOUT_SOCKET
+    base = os.environ.get("RUNTIME_DIRECTORY", "").split(":")[0]
+    if not base:
+        base = "/tmp/digidash-{}".format(os.getuid())
+        try:
+            os.mkdir(base, 0o700)
+        except FileExistsError:
+            pass
+        st = os.lstat(base)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise RuntimeError("{} must be a directory owned by this user with mode 0700".format(base))
+    return os.path.join(base, "fanout-{}.sock".format(WS_PORT))
+
+def _remove_stale_socket(path):
+    """Unlinks a socket left by an earlier run, but nothing else and nobody else's."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise RuntimeError("{} exists and is not a socket owned by this user; not replacing it".format(path))
+    os.unlink(path)
+
+class RelayedQuery(object):
+    """Stands in for a worker's ClientSession while the ingestion process answers its query."""
+    def __init__(self, writer, rid):
+        self.writer = writer
+        self.rid = rid
+
+    def reply(self, msg):
+        if not self.writer.transport.is_closing():
+            write_message(self.writer, {"type": "reply", "rid": self.rid, "msg": msg})
+
+class FanoutPublisher(object):
+    """Ingestion side: starts the workers, keeps them running and feeds them ticks."""
+    def __init__(self, path, count):
+        self.path = path
+        self.count = count
+        self.links = {}       # writer -> worker id
+        self.reports = {}     # worker id -> last client_counters()
+        self.restarts = 0
+
+    async def start(self):
+        _remove_stale_socket(self.path)
+        # the frames and the query relay are for our workers only: 0600
+        # from the moment it exists
+        old_umask = os.umask(0o177)
+        try:
+            await asyncio.start_unix_server(self._accept, path=self.path)
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.path, 0o600)
+        for worker_id in range(self.count):
+            asyncio.ensure_future(self._supervise(worker_id))
+
+    async def _supervise(self, worker_id):
+        while True:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--fanout-worker", self.path,
+                "--worker-id", str(worker_id), "--port", str(WS_PORT))
+            code = await proc.wait()
+            self.reports.pop(worker_id, None)
+            self.restarts += 1
+            log_flush("Fan-out worker {} exited ({}); restarting".format(worker_id, code))
+            await asyncio.sleep(1)
+
+    async def _accept(self, reader, writer):
+        worker_id = None
+        try:
+            while True:
+                header, parts = await read_message(reader)
+                kind = header.get("type")
+                if kind == "hello":
+                    worker_id = header.get("worker")
+                    write_message(writer, {"type": "hello", "status_sections": list(STATUS_SECTIONS),
+                                           "etag_token": _etag_token})
+                    self.links[writer] = worker_id
+                    if latest_frame is not None:
+                        # prime the new worker so it has state before its first client
+                        self._send(writer, self._tick(True, False, True))
+                elif kind == "report":
+                    self.reports[worker_id] = header.get("counters")
+                elif kind == "request":
+                    asyncio.ensure_future(self._answer(RelayedQuery(writer, header.get("rid")), header.get("msg") or {}))
+                elif kind == "metrics":
+                    write_message(writer, {"type": "reply", "rid": header.get("rid")}, [render_metrics()])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.links.pop(writer, None)
+            self.reports.pop(worker_id, None)
+            writer.close()
+
+    async def _answer(self, relay, msg):
+        if msg.get("type") == "history":
+            await answer_history_query(relay, msg)
+        elif msg.get("type") == "stats":
+            answer_stats_query(relay, msg)
+
+    def _tick(self, changed, heartbeat_due, with_last_heard):
+        header = {"type": "tick", "seq": state_version, "changed": changed, "heartbeat": heartbeat_due}
+        if with_last_heard:
+            header["last_heard"] = list(deep_last_heard())
+        update = encode_frame(update_message(state_version, latest_data, latest_delta, changed), "json")
+        return header, [latest_frame, update]
+
+    def _send(self, writer, message):
+        if writer.transport.get_write_buffer_size() > FANOUT_MAX_BUFFER:
+            # the worker exits on EOF and comes back with a fresh state
+            log_flush("Fan-out worker {} fell behind; dropping it".format(self.links.get(writer)))
+            self.links.pop(writer, None)
+            writer.close()
+            return
+        write_message(writer, *message)
+
+    def publish(self, changed, heartbeat_due):
+        if not self.links or latest_frame is None:
             return
+        lh_changed = changed and "last_heard" in ((latest_delta or {}).get("combined") or {})
+        message = self._tick(changed, heartbeat_due, lh_changed)
+        for writer in list(self.links):
+            self._send(writer, message)
+
+class FanoutLink(object):
+    """Worker side: mirrors the ingestion process's state and relays queries to it."""
+    def __init__(self, path, worker_id):
+        self.path = path
+        self.worker_id = worker_id
+        self.last_heard = []
+        self.pending = {}     # rid -> ClientSession (queries) or Future (/metrics)
+        self.next_rid = 0
+        self.next_report = 0.0
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        global STATUS_SECTIONS, _etag_token
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        write_message(self.writer, {"type": "hello", "worker": self.worker_id})
+        header, _ = await read_message(self.reader)
+        STATUS_SECTIONS = tuple(header.get("status_sections") or STATUS_SECTIONS)
+        # same ETag whichever worker answers the poll
+        _etag_token = header.get("etag_token") or _etag_token
+
+    async def run(self):
+        while True:
+            header, parts = await read_message(self.reader)
+            kind = header.get("type")
+            if kind == "tick":
+                await self.tick(header, parts)
+            elif kind == "reply":
+                target = self.pending.pop(header.get("rid"), None)
+                if isinstance(target, asyncio.Future):
+                    if not target.done():
+                        target.set_result(parts[0] if parts else "")
+                elif target is not None and target in connected_clients:
+                    target.reply(header.get("msg"))
+
+    async def tick(self, header, parts):
+        global latest_data, latest_state, latest_delta, state_version
+        full, update = parts
+        changed = header.get("changed")
+        latest_data = json.loads(full)
+        if changed or latest_state is None:
+            state = dict(latest_data)
+            state.pop("uptime_seconds", None)
+            delta = json.loads(update)
+            for k in ("type", "seq", "uptime_seconds"):
+                delta.pop(k, None)
+            latest_state, latest_delta = state, delta
+        state_version = header.get("seq")
+        if "last_heard" in header:
+            self.last_heard = header["last_heard"]
+        await broadcast(changed, header.get("heartbeat"), {"json": full}, {"json": update})
+        now = time.monotonic()
+        if now >= self.next_report:
+            self.next_report = now + SNAPSHOT_HEARTBEAT_SECONDS
+            write_message(self.writer, {"type": "report", "counters": client_counters()})
+
+    def _rid(self, target):
+        self.next_rid += 1
+        self.pending[self.next_rid] = target
+        return self.next_rid
+
+    def forward(self, session, msg):
+        write_message(self.writer, {"type": "request", "rid": self._rid(session), "msg": msg})
+
+    async def metrics(self):
+        future = asyncio.Future()
+        rid = self._rid(future)
+        write_message(self.writer, {"type": "metrics", "rid": rid})
+        try:
+            return await asyncio.wait_for(future, 5)
+        finally:
+            self.pending.pop(rid, None)
+
+def start_fanout(count):
+    global fanout_publisher
+    try:
+        fanout_publisher = FanoutPublisher(fanout_socket_path(), count)
+        asyncio.get_event_loop().run_until_complete(fanout_publisher.start())
+    except RuntimeError as e:
+        log_flush("Fan-out: {}. Exiting.".format(e))
+        raise SystemExit(1)
+    log_flush("Fan-out: {} worker processes on port {} (publishing on {})".format(
+        count, WS_PORT, fanout_publisher.path))
+
+def run_fanout_worker(args):
+    global fanout_link
+    fanout_link = FanoutLink(args.fanout_worker, args.worker_id)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(fanout_link.connect())
+    loop.run_until_complete(serve_clients(reuse_port=True))
+    log_flush("Fan-out worker {} serving port {}".format(args.worker_id, WS_PORT))
+    try:
+        loop.run_until_complete(fanout_link.run())
+    except (asyncio.IncompleteReadError, ConnectionError) as e:
+        log_flush("Fan-out worker {}: lost the ingestion process ({}); exiting".format(
+            args.worker_id, type(e).__name__))
+
+# -----------------------------
+# Parser micro-benchmark (--bench-parsers)
+# -----------------------------
+# Times the single-pass dispatch against the original sequential .search()
+# chain on a synthetic mix of event and noise messages, and checks that
+# both classify every message the same way.
+BENCH_SAMPLES = {
+    "M17": (
+        [
+            "Opening stream on module A for client N0CALL with sid 4660",
+            "Closing stream on module A",
+            "Connect packet for module B from W1AW at 192.0.2.10",
+            "Client W1AW B keepalive timeout",
+            "Disconnect packet from W1AW B at 192.0.2.10",
+        ],
+        [
+            "Keepalive from N0CALL at 192.0.2.10",
+            "Peer M17-XXX linked on module A",
+            "Sending keepalive to 12 clients",
+            "Listening on 0.0.0.0:17000",
+            "Stream on module A: 240 packets, 0 lost",
+        ],
+    ),
+    "DMR": (
+        [
+            "DMR Talker Alias (Data Format 1, Received 24/24 char): 'N0CALL Bob'",
+            "DMR Slot 2, received network voice header from N0CALL to TG 91",
+            "DMR Slot 2, received network end of voice transmission, 3.1 seconds, 0% packet loss, BER: 0.0%",
+            "DMR, Begin TX: src=3100000 rpt=310000001 dst=91 slot=2 cc=1 metadata=N0CALL",
+            "DMR, TX state = OFF",
+            # other casings; the patterns are IGNORECASE
+            "DMR, tx state = off",
+            "dmr slot 2, Received Network Voice Header from N0CALL to tg 91",
+            "DMR Talker ALIAS (Data Format 1, Received 24/24 char): 'N0CALL Bob'",
+        ],
+        [
+            "DMR Slot 2, audio sequence no. 3, errs: 0/141 (0.0%)",
+            "DMR Slot 2, received network data header from N0CALL to TG 91, 3 blocks",
+            "YSF, received network data from N0CALL to ALL at N0CALL",
+            "Mode set to DMR",
+            "Network watchdog has expired, 2.0 seconds, 0% packet loss",
+            "Lost connection to the DMR Network, retrying",
+        ],
+    ),
+    "P25": (
+        [
+            "M: 2026-02-01 22:14:00.164 Transmission started from N0CALL",
+            "M: 2026-02-01 22:14:00.201 Transmission from 3100000 at N0CALL to TG 10200",
+            "M: 2026-02-01 22:14:03.410 Received end of transmission",
+        ],
+        [
+            "M: 2026-02-01 22:14:00.164 Adding N0CALL (192.0.2.10:41000)",
+            "M: 2026-02-01 22:14:00.164 Currently linked repeaters/gateways:",
+            "M: 2026-02-01 22:14:00.164     N0CALL    : 192.0.2.10:41000 2/60",
+            "D: 2026-02-01 22:14:00.164 Network data received",
+            "M: 2026-02-01 22:14:00.164 Removing N0CALL (192.0.2.10:41000) disappeared",
+        ],
+    ),
+    "YSF": (
+        [
+            "YSF, received network data from N0CALL     to DG-ID 0 at N0CALL",
+            "YSF, received network end of transmission, 3.4 seconds, 0% packet loss, BER: 0.0%",
+            "YSF, Received Network end of transmission, 3.4 seconds, 0% packet loss, BER: 0.0%",
+        ],
+        [
+            "YSF, Network watchdog has expired, 1.5 seconds, 0% packet loss",
+            "YSF, Opening the YSF network connection",
+            "DMR Slot 2, audio sequence no. 3, errs: 0/141 (0.0%)",
+            "Linked to YSF2DMR",
+            "YSF, received RF header from N0CALL     to DG-ID 0",
+        ],
+    ),
+}
+
+def _sequential_classify(msg, pairs):
+    for kind, rx in pairs:
+        if rx.search(msg):
+            return kind
+    return None
+
+def _sequential_classify_p25(msg):
+    mm = p25_m_prefix_re.match(msg)
+    if not mm:
+        return None
+    payload = mm.group(1).strip()
+    for kind, rx in (("started", p25_tx_started_re), ("tx_from", p25_tx_from_re), ("tx_end", p25_tx_end_re)):
+        if rx.match(payload):
+            return kind
+    return None
+
+def _dispatch_kind(classify):
+    def kind(msg):
+        m = classify(msg)
+        return m.lastgroup if m else None
+    return kind
+
+def bench_parsers(lines_per_mode=200000, noise_ratio=0.8):
+    sequential = {
+        "M17": lambda msg: _sequential_classify(msg, (
+            ("open", open_stream_pattern), ("close", close_stream_pattern),
+            ("connect", connect_packet_pattern), ("disconnect", disconnect_packet_pattern),
+            ("droidstar", droidstar_disconnect_pattern))),
+        "DMR": lambda msg: _sequential_classify(msg, (
+            ("alias", dmr_talker_alias_re), ("header", dmr_net_header_re), ("end", dmr_net_end_re),
+            ("begin", mmdvm_begin_tx_re), ("tx_state", mmdvm_tx_state_re))),
+        "P25": _sequential_classify_p25,
+        "YSF": lambda msg: _sequential_classify(msg, (("data", ysf_net_data_re), ("end", ysf_net_end_re))),
+    }
+    dispatch = {
+        "M17": _dispatch_kind(classify_m17),
+        "DMR": _dispatch_kind(classify_dmr),
+        "P25": _dispatch_kind(classify_p25),
+        "YSF": _dispatch_kind(classify_ysf),
+    }
+
+    print("Parser micro-benchmark: {} lines/mode, {:.0f}% noise".format(lines_per_mode, noise_ratio * 100))
+    for mode in ("M17", "DMR", "P25", "YSF"):
+        events, noise = BENCH_SAMPLES[mode]
+        corpus = []
+        n_noise = int(round(noise_ratio * 10))
+        i = 0
+        while len(corpus) < lines_per_mode:
+            for _ in range(n_noise):
+                corpus.append(noise[i % len(noise)])
+                i += 1
+            for _ in range(10 - n_noise):
+                corpus.append(events[i % len(events)])
+                i += 1
+        del corpus[lines_per_mode:]
+
+        old_fn = sequential[mode]
+        new_fn = dispatch[mode]
+        mismatches = [msg for msg in events + noise if old_fn(msg) != new_fn(msg)]
+
+        t0 = time.perf_counter()
+        for msg in corpus:
+            old_fn(msg)
+        t_old = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for msg in corpus:
+            new_fn(msg)
+        t_new = time.perf_counter() - t0
+
+        print("  {}  sequential {:>10.0f} lines/s   dispatch {:>10.0f} lines/s   x{:.2f}   mismatches={}".format(
+            mode, len(corpus) / t_old, len(corpus) / t_new, t_old / t_new, len(mismatches)))
+        for msg in mismatches:
+            print("      MISMATCH: {!r} sequential={} dispatch={}".format(msg, old_fn(msg), new_fn(msg)))
+
+# -----------------------------
+# Journal replay harness (--replay)
+# -----------------------------
+# Plays recorded journal captures through the real queues, parsers and
+# snapshot builder, so parser and snapshot cost can be measured without
+# radios. Record with e.g.
+#     journalctl -u mmdvm_bridge.service -o short-iso-precise > dmr.log
+# and replay with
+#     python3 websocket_server.py --replay dmr=dmr.log --replay m17=m17.log
+# --speed max (default) runs the clock on the recorded timestamps, so the
+# run is deterministic: lines/s per mode, snapshot build cost and a check
+# against --golden FILE (--write-golden FILE records one). --speed N paces
+# the lines N times faster than recorded through snapshot_producer and two
+# local websocket clients and reports end-to-end latency.
+REPLAY_MODES = ("m17", "dmr", "p25", "ysf")
+REPLAY_TALKING_SIZES = (0, 10, 100, 1000)
+
+class ReplayClock(object):
+    """
+    Journal time for replays. Follows the last record fed; at Nx speed it
+    keeps running between records at N times wall-clock rate.
+    """
+    def __init__(self, speed=None):
+        self.speed = speed
+        self._epoch = None
+        self._wall = None
+
+    def set(self, epoch):
+        self._epoch = epoch
+        self._wall = time.perf_counter()
+
+    def time(self):
+        if self._epoch is None:
+            return time.time()
+        if not self.speed:
+            return self._epoch
+        return self._epoch + (time.perf_counter() - self._wall) * self.speed
+
+class ReplayStats(object):
+    def __init__(self):
+        self.lines = dict((m, 0) for m in replay_mode_names())
+        self.parse_seconds = dict((m, 0.0) for m in replay_mode_names())
+        self.build_seconds = []
+        self.enqueued = []          # perf_counter() per line (paced runs)
+        self.batch = (0, 0)         # enqueued[] slice taken by the last build
+        self.latencies = []
+
+_capture_frac_re = re.compile(r":\d{2}\.(\d+)")
+
+# Captures may come from this box (-o short) or be recorded elsewhere with
+# -o short-iso-precise.
+_capture_iso_re = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.\d+)?([+-]\d{4})\s+\S+\s+([^:]+):\s+(.*)$")
+
+def split_capture_line(line):
+    m = _capture_iso_re.match(line)
+    if m:
+        return m.group(0).split(None, 1)[0], m.group(3), m.group(4)
+    return split_syslog(line)
+
+def capture_time_to_epoch(ts):
+    m = re.match(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.\d+)?([+-]\d{4})$", ts)
+    try:
+        if m:
+            epoch = datetime.strptime(m.group(1) + m.group(2), "%Y-%m-%dT%H:%M:%S%z").timestamp()
+        else:
+            epoch = parse_syslog_time(ts.split(".", 1)[0])
+    except Exception:
+        return None
+    if epoch is None:
+        return None
+    m = _capture_frac_re.search(ts)
+    if m:
+        epoch += float("0." + m.group(1))
+    return epoch
+
+def replay_mode_names():
+    return REPLAY_MODES + tuple(mode.key for mode in declarative_modes)
+
+def replay_queue(mode):
+    for dm in declarative_modes:
+        if dm.key == mode:
+            return dm.queue
+    return {"m17": m17_q, "dmr": dmr_q, "p25": p25_q, "ysf": ysf_q}[mode]
+
+def load_capture(mode, path):
+    """[(epoch, mode, msg)] from a journalctl text capture, plus skipped line count."""
+    out = []
+    skipped = 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            ts, _proc, msg = split_capture_line(line.rstrip("\n"))
+            epoch = capture_time_to_epoch(ts) if ts else None
+            if epoch is None:
+                # "-- Boot ... --" / "-- No entries --" separators
+                skipped += 1
+                continue
+            out.append((epoch, mode, msg))
+    return out, skipped
+
+def _install_replay_hooks(stats):
+    """Wraps the parse/build/broadcast globals with timers for the run."""
+    g = globals()
+
+    def timed_parser(mode, fn):
+        def run():
+            t0 = time.perf_counter()
+            fn()
+            stats.parse_seconds[mode] += time.perf_counter() - t0
+        return run
+
+    for mode in REPLAY_MODES:
+        name = "parse_{}_lines".format(mode)
+        g[name] = timed_parser(mode, g[name])
+    for dm in declarative_modes:
+        dm.parse = timed_parser(dm.key, dm.parse)
+
+    orig_build = g["build_snapshot"]
+    def timed_build():
+        start = len(stats.enqueued)
+        t0 = time.perf_counter()
+        data = orig_build()
+        stats.build_seconds.append(time.perf_counter() - t0)
+        stats.batch = (stats.batch[1], start)
+        return data
+    g["build_snapshot"] = timed_build
+
+    orig_broadcast = g["broadcast"]
+    async def timed_broadcast(changed, heartbeat_due):
+        await orig_broadcast(changed, heartbeat_due)
+        while any(s.outbox or s.sending for s in list(connected_clients)):
+            await asyncio.sleep(0.0005)
+        if changed:
+            now = time.perf_counter()
+            lo, hi = stats.batch
+            stats.latencies.extend(now - t for t in stats.enqueued[lo:hi])
+    g["broadcast"] = timed_broadcast
+
+def _replay_max(records, stats):
+    """Feeds records on journal time; one build per coalesce window, like snapshot_producer."""
+    frames = []
+
+    def tick():
+        data = build_snapshot()
+        if note_snapshot(data):
+            frames.append({"seq": state_version, "epoch": round(now_epoch(), 6), "state": latest_state})
+
+    window_start = None
+    for epoch, mode, msg in records:
+        if window_start is not None and epoch - window_start >= PUSH_COALESCE_SECONDS:
+            clock.set(window_start + PUSH_COALESCE_SECONDS)
+            tick()
+            window_start = None
+        clock.set(epoch)
+        enqueue_record(replay_queue(mode), (epoch, format_journal_ts(epoch), msg))
+        stats.lines[mode] += 1
+        if window_start is None:
+            window_start = epoch
+    if window_start is not None:
+        clock.set(window_start + PUSH_COALESCE_SECONDS)
+        tick()
+    return frames
+
+async def _replay_paced(records, speed, stats, port=0):
+    server = await websockets.serve(websocket_handler, "127.0.0.1", port,
+                                    process_request=process_http_request,
+                                    subprotocols=SUBPROTOCOLS, **websocket_serve_options())
+    port = server.sockets[0].getsockname()[1]
+    producer = asyncio.ensure_future(snapshot_producer())
+    clients = [
+        await websockets.connect("ws://127.0.0.1:{}/".format(port)),
+        await websockets.connect("ws://127.0.0.1:{}/?proto=delta".format(port)),
+    ]
+
+    async def drain(ws):
+        try:
+            while True:
+                await ws.recv()
+        except Exception:
+            pass
+    readers = [asyncio.ensure_future(drain(ws)) for ws in clients]
+
+    def feed():
+        t0 = time.perf_counter()
+        first = records[0][0]
+        for epoch, mode, msg in records:
+            delay = (epoch - first) / speed - (time.perf_counter() - t0)
+            if delay > 0:
+                time.sleep(delay)
+            clock.set(epoch)
+            enqueue_record(replay_queue(mode), (epoch, format_journal_ts(epoch), msg))
+            stats.lines[mode] += 1
+            stats.enqueued.append(time.perf_counter())
+            notify_push()
 
-        await asyncio.sleep(1)
+    loop = asyncio.get_event_loop()
+    t0 = time.perf_counter()
+    await loop.run_in_executor(None, feed)
+    await asyncio.sleep(PUSH_COALESCE_SECONDS + 0.5)
+    elapsed = time.perf_counter() - t0
+
+    for ws in clients:
+        await ws.close()
+    for t in readers + [producer]:
+        t.cancel()
+    server.close()
+    await server.wait_closed()
+    return elapsed
+
+def bench_clients_talking(sizes, iters=200):
+    """[(n, seconds per build)] with n M17 entries in the talking table."""
+    global asl_rollup_state
+    saved_talking = dict(clients_talking)
+    saved_asl = dict(asl_rollup_state)
+    out = []
+    try:
+        base = now_epoch()
+        for n in sizes:
+            clients_talking.clear()
+            for i in range(n):
+                talking = (i % 2 == 0)
+                clients_talking["N{}TEST".format(i)] = {
+                    "status": "talking" if talking else "not talking", "module": "ABCD"[i % 4],
+                    "start_time": format_journal_ts(base), "end_time": None if talking else format_journal_ts(base),
+                    "start_epoch": base, "end_epoch": None if talking else base,
+                }
+            t0 = time.perf_counter()
+            for _ in range(iters):
+                build_combined_clients_talking()
+            out.append((n, (time.perf_counter() - t0) / iters))
+    finally:
+        clients_talking.clear()
+        clients_talking.update(saved_talking)
+        asl_rollup_state = saved_asl
+    return out
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))]
+
+def _compare_golden(frames, path):
+    golden = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                golden.append(json.loads(line))
+    # round-trip ours so tuples/ints compare the way they were written
+    ours = [json.loads(json.dumps(fr, sort_keys=True)) for fr in frames]
+    for i, (a, b) in enumerate(zip(ours, golden)):
+        if a != b:
+            keys = sorted(k for k in set(a["state"]) | set(b["state"]) if a["state"].get(k) != b["state"].get(k))
+            return "MISMATCH at frame {} (seq {}, epoch {}): {}".format(i, a.get("seq"), a.get("epoch"), ", ".join(keys) or "seq/epoch")
+    if len(ours) != len(golden):
+        return "MISMATCH: {} frames, golden has {}".format(len(ours), len(golden))
+    return None
+
+def run_replay(args):
+    global DEBUG, clock
+    DEBUG = args.replay_verbose
+
+    speed = None
+    if args.speed != "max":
+        try:
+            speed = float(args.speed)
+        except ValueError:
+            speed = 0
+        if speed <= 0:
+            print("--speed must be 'max' or a positive number")
+            raise SystemExit(2)
+
+    records = []
+    skipped = 0
+    for spec in args.replay:
+        mode, _, path = spec.partition("=")
+        mode = mode.strip().lower()
+        if mode not in replay_mode_names() or not path:
+            print("--replay expects MODE=FILE with MODE one of {}".format(", ".join(replay_mode_names())))
+            raise SystemExit(2)
+        recs, sk = load_capture(mode, path)
+        records.extend(recs)
+        skipped += sk
+    records.sort(key=lambda r: r[0])
+    if not records:
+        print("Nothing to replay.")
+        raise SystemExit(2)
+
+    if speed is None and hasattr(time, "tzset"):
+        # Display timestamps land in the golden file; make them TZ-independent.
+        os.environ["TZ"] = "UTC"
+        time.tzset()
+
+    clock = ReplayClock(speed)
+    stats = ReplayStats()
+    _install_replay_hooks(stats)
+
+    span = records[-1][0] - records[0][0]
+    print("Replay: {} lines from {} capture(s), {} skipped, {:.0f}s of journal time, speed {}".format(
+        len(records), len(args.replay), skipped, span, args.speed))
+
+    frames = []
+    if speed is None:
+        t0 = time.perf_counter()
+        frames = _replay_max(records, stats)
+        elapsed = time.perf_counter() - t0
+    else:
+        loop = asyncio.get_event_loop()
+        elapsed = loop.run_until_complete(_replay_paced(records, speed, stats, args.port or 0))
+
+    print("  wall time {:.2f}s, {} state changes".format(elapsed, state_version))
+    for mode in replay_mode_names():
+        n = stats.lines[mode]
+        if n:
+            secs = stats.parse_seconds[mode]
+            print("  {:<4} {:>8} lines   parse {:>12.0f} lines/s".format(mode.upper(), n, n / secs if secs else 0.0))
+    b = stats.build_seconds
+    if b:
+        print("  snapshot build   n={}  mean {:.1f}us  p95 {:.1f}us  max {:.1f}us".format(
+            len(b), 1e6 * sum(b) / len(b), 1e6 * _pct(b, 95), 1e6 * max(b)))
+    print("  build_combined_clients_talking vs. talking table size:")
+    for n, secs in bench_clients_talking(REPLAY_TALKING_SIZES):
+        print("      {:>5} entries  {:>9.1f}us".format(n, secs * 1e6))
+    if frames:
+        print("  frame encodings over {} snapshots (msgpack: {}):".format(
+            len(frames), "C module" if msgpack is not None else "pure Python"))
+        for enc, raw, secs, deflated in bench_encodings([fr["state"] for fr in frames]):
+            print("      {:<8} {:>8.0f} B/frame  encode {:>7.1f}us  with deflate {:>6.0f} B/frame".format(
+                enc, raw, secs * 1e6, deflated))
+    if speed is not None:
+        lat = stats.latencies
+        print("  end-to-end latency (enqueue -> frame written)  n={}  p50 {:.1f}ms  p95 {:.1f}ms  max {:.1f}ms".format(
+            len(lat), 1e3 * _pct(lat, 50), 1e3 * _pct(lat, 95), 1e3 * (max(lat) if lat else 0.0)))
+
+    if args.write_golden:
+        if speed is not None:
+            print("  --write-golden needs --speed max")
+        else:
+            with open(args.write_golden, "w") as f:
+                for fr in frames:
+                    f.write(json.dumps(fr, sort_keys=True) + "\n")
+            print("  golden: wrote {} frames to {}".format(len(frames), args.write_golden))
+    if args.golden:
+        if speed is not None:
+            print("  --golden needs --speed max")
+        else:
+            problem = _compare_golden(frames, args.golden)
+            if problem:
+                print("  golden: " + problem)
+                raise SystemExit(1)
+            print("  golden: OK ({} frames)".format(len(frames)))
 
 # -----------------------------
 # Heartbeat thread
@@ -815,11 +4476,17 @@ def heartbeat_loop():
                 parts.append("{} age={}s q={} spawns={} dead={} err={}".format(
                     f.unit_name,
                     age if age is not None else -1,
-                    len(f.q),
+                    f.queue_depth(),
                     f.spawn_count,
                     f.dead_count,
                     f.last_error if f.last_error else "-"
                 ))
+            if history_store is not None:
+                parts.append("history written={} pending={} err={}".format(
+                    history_store.written,
+                    history_store.pending(),
+                    history_store.last_error if history_store.last_error else "-"
+                ))
             log_flush("HEARTBEAT: " + " | ".join(parts))
         except Exception as e:
             log_flush("HEARTBEAT error: {}".format(e))
@@ -828,27 +4495,90 @@ def heartbeat_loop():
 # -----------------------------
 # Main (TLS)
 # -----------------------------
-def main():
-    log_flush("Starting websocket_server (journald direct) on {}:{} (TLS)".format(WS_BIND, WS_PORT))
-
-    apply_auto_disable()
-    build_followers()
+def serve_clients(**kwargs):
+    """websockets.serve() for the viewers, on WS_BIND:WS_PORT."""
+    kwargs = dict(websocket_serve_options(), **kwargs)
+    return websockets.serve(websocket_handler, WS_BIND, WS_PORT, ssl=server_ssl_context(),
+                            process_request=process_http_request,
+                            subprotocols=SUBPROTOCOLS, **kwargs)
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="DigiDash websocket server")
+    ap.add_argument("--bench-parsers", action="store_true",
+                    help="run the parser micro-benchmark and exit")
+    ap.add_argument("--replay", action="append", metavar="MODE=FILE",
+                    help="replay a journalctl capture (mode m17/dmr/p25/ysf or a declarative mode); repeatable")
+    ap.add_argument("--speed", default="max",
+                    help="replay speed: 'max' or a multiple of real time (default max)")
+    ap.add_argument("--golden", metavar="FILE", help="compare replayed snapshots against FILE")
+    ap.add_argument("--write-golden", metavar="FILE", help="write replayed snapshots to FILE")
+    ap.add_argument("--replay-verbose", action="store_true", help="keep parser logging on during replay")
+    ap.add_argument("--hub", action="store_true", help="merge the HUB_UPSTREAMS servers instead of reading the journal")
+    ap.add_argument("--upstream", action="append", metavar="NODE=URL",
+                    help="hub upstream, e.g. north=ws://192.0.2.10:8765/ (repeatable; implies --hub, replaces HUB_UPSTREAMS)")
+    ap.add_argument("--port", type=int, help="listen on this port instead of WS_PORT (paced replays too)")
+    ap.add_argument("--workers", type=int, metavar="N",
+                    help="serve clients from N worker processes sharing the port (default FANOUT_WORKERS)")
+    ap.add_argument("--fanout-worker", metavar="SOCKET", help=argparse.SUPPRESS)
+    ap.add_argument("--worker-id", type=int, default=0, help=argparse.SUPPRESS)
+    return ap.parse_args(argv)
 
-    if not followers:
-        log_flush("No modes enabled/found. Exiting.")
+def main():
+    global WS_PORT
+    started = time.monotonic()
+    args = parse_args()
+    if args.port:
+        WS_PORT = args.port
+    load_modes()
+    if args.bench_parsers:
+        bench_parsers()
+        return
+    if args.replay:
+        run_replay(args)
+        return
+    if args.fanout_worker:
+        run_fanout_worker(args)
         return
 
-    for f in followers:
-        f.start()
+    if args.hub or args.upstream:
+        if not setup_hub(args):
+            log_flush("Hub mode needs HUB_UPSTREAMS or --upstream. Exiting.")
+            return
+        log_flush("Starting websocket_server hub on {}:{} (TLS) for {}".format(
+            WS_BIND, WS_PORT, ", ".join("{} ({})".format(n.name, n.url) for n in hub_nodes)))
+    else:
+        log_flush("Starting websocket_server (journald direct) on {}:{} (TLS)".format(WS_BIND, WS_PORT))
+        apply_auto_disable()
+        build_followers()
+        init_history()
+        start_dmrid_watcher()
+
+        if not followers:
+            log_flush("No modes enabled/found. Exiting.")
+            return
 
-    t = threading.Thread(target=heartbeat_loop)
-    t.daemon = True
-    t.start()
+        for f in followers:
+            f.start()
+
+        t = threading.Thread(target=heartbeat_loop)
+        t.daemon = True
+        t.start()
 
-    start_server = websockets.serve(websocket_handler, WS_BIND, WS_PORT, ssl=ssl_context)
+    workers = FANOUT_WORKERS if args.workers is None else args.workers
+    if workers > 0 and not hasattr(socket, "SO_REUSEPORT"):
+        log_flush("SO_REUSEPORT is not available here; serving clients from this process")
+        workers = 0
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(start_server)
-    log_flush("Websocket server is running (wss) on port {}".format(WS_PORT))
+    if workers > 0:
+        start_fanout(workers)
+    else:
+        loop.run_until_complete(serve_clients())
+    for node in hub_nodes:
+        asyncio.ensure_future(upstream_loop(node))
+    asyncio.ensure_future(snapshot_producer())
+    log_flush("Startup took {:.3f}s".format(time.monotonic() - started))
+    if not workers:
+        log_flush("Websocket server is running (wss) on port {}".format(WS_PORT))
     loop.run_forever()
 
 if __name__ == "__main__":